@@ -1,15 +1,70 @@
 import os
+import copy
+import functools
+import gc
 import json
-import shutil
+import math
 import re
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
 from flask import Flask, render_template, request, jsonify, redirect, url_for, abort
+from flask.json.provider import DefaultJSONProvider
+
+from records import Record, to_json
+from store import StatblockStore, normalize_name
+from search import SUGGEST_LIMIT, MAX_SUGGEST_LIMIT
+from bulk_import import iter_cards, run_import
+from metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+
+class CodexJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, also writing compact statblock records."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return to_json(o)
+        return DefaultJSONProvider.default(o)
+
 
 app = Flask(__name__)
+app.json = CodexJSONProvider(app)
 
 # Data file
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(ROOT_DIR, "data")
 DATA_FILE = os.path.join(DATA_DIR, "statblocks.json")
+DEFAULT_FILE = os.path.join(DATA_DIR, "statblocks_default.json")
+
+# Storage backend: "json" (the default) or "sqlite"
+STORAGE = os.environ.get("CODEX_STORAGE", "json")
+DB_FILE = os.environ.get("CODEX_DB", os.path.join(DATA_DIR, "statblocks.db"))
+# Keep statblocks in memory as compact read-only records rather than dicts
+COMPACT_RECORDS = os.environ.get("CODEX_COMPACT_RECORDS", "1") != "0"
+
+# Seconds clients may reuse a read response before revalidating it
+CACHE_MAX_AGE = int(os.environ.get("CODEX_CACHE_MAX_AGE", "0"))
+# Serialized read responses kept for the current data version
+RESPONSE_CACHE_SIZE = 1024
+# Most items accepted by one batch request
+MAX_BATCH = 1000
+# Results returned by a ranked search when no limit is given
+RANKED_LIMIT = 20
+# Re-tiered statblocks kept by the retier cache
+RETIER_CACHE_SIZE = 4096
+# Parsed statblocks, and parsed lines of each kind, kept by the parse caches
+PARSE_CACHE_SIZE = 512
+PARSE_LINE_CACHE_SIZE = 8192
+# Requests taking at least this many milliseconds are logged; 0 turns the log off
+SLOW_REQUEST_MS = float(os.environ.get("CODEX_SLOW_REQUEST_MS", "0"))
+# Seconds between checks for saves made by other server processes
+WATCH_INTERVAL = float(os.environ.get("CODEX_WATCH_INTERVAL", "1"))
+# Seconds between keep-alive comments on an idle /api/changes stream
+CHANGES_HEARTBEAT = 15
+# Longest a /api/changes long poll waits for a save, in seconds
+CHANGES_LONG_POLL = 25
 
 # Categories and types
 CATEGORIES = {
@@ -18,44 +73,85 @@ CATEGORIES = {
 }
 
 TIERS = [1, 2, 3, 4]
+TIER_CHOICES = ', '.join(str(t) for t in TIERS)
+TIER_ERROR = f'new_tier must be one of {TIER_CHOICES}'
+# Raised by retier() for statblocks whose numbers it cannot read
+RETIER_ERRORS = (AttributeError, KeyError, TypeError, ValueError, IndexError)
 
 
-def ensure_data():
-    if not os.path.isdir(DATA_DIR):
-        os.makedirs(DATA_DIR, exist_ok=True)
-    
-    if not os.path.isfile(DATA_FILE):
-        default_file = os.path.join(DATA_DIR, "statblocks_default.json")
-        if os.path.isfile(default_file):
-            shutil.copy(default_file, DATA_FILE)
-        else:
-            with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump([], f, indent=2)
+if STORAGE == "sqlite":
+    from sqlite_store import SqliteStore
+    store = SqliteStore(DB_FILE, DEFAULT_FILE)
+else:
+    store = StatblockStore(DATA_FILE, DEFAULT_FILE, compact_records=COMPACT_RECORDS,
+                           write_cache=True)
 
+metrics = Metrics()
 
-def load_data():
-    ensure_data()
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+
+@app.before_request
+def start_timing():
+    metrics.start_request()
 
 
-def save_data(data):
+@app.after_request
+def record_timing(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    timing = metrics.end_request(endpoint, request.method, response.status_code)
+    if timing and SLOW_REQUEST_MS and timing[0] * 1000 >= SLOW_REQUEST_MS:
+        phases = ''.join(f' {phase}={seconds * 1000:.1f}ms' for phase, seconds in timing[1].items())
+        app.logger.warning('Slow request: %s %s %s took %.1fms%s', request.method,
+                           request.full_path.rstrip('?'), response.status_code,
+                           timing[0] * 1000, phases)
+    return response
+
+
+def current_data():
+    """Returns the current store snapshot, timed as the load phase."""
+    with metrics.span('load'):
+        return store.snapshot()
+
+
+def serialize(value):
+    """jsonify(), timed as the serialize phase."""
+    with metrics.span('serialize'):
+        return jsonify(value)
+
+
+def ensure_data():
+    store.ensure()
+
+
+def preload_data():
+    """Creates the data file if needed and loads the data and search indexes."""
     ensure_data()
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    snap = store.snapshot()
+    if hasattr(snap, 'search_index'):
+        snap.search_index()
+        snap.suggest_index()
+    # Leave everything loaded so far out of later collections, so that they
+    # do not touch (and un-share) the pages of forked workers
+    gc.freeze()
 
 
 def find_stat(data, name):
-    name_lower = name.strip().lower()
+    if not isinstance(data, list):
+        # Store snapshots have a name index
+        return data.get(name)
+    name_lower = normalize_name(name)
     for s in data:
         if s.get('name', '').strip().lower() == name_lower:
             return s
     return None
 
+DICE_RE = re.compile(r'^(\d+)d(\d+)([+-]\d+)?$')
+THRESHOLDS_RE = re.compile(r'^(\d+)/(\d+)$')
+FEATURE_DICE_RE = re.compile(r'(\d+d\d+[+-]\d+|\d+d\d+)')
+
+
 def revalue_dice(dice_str, old_tier, new_tier):
     "Ppdates dice roll description based on a tier change."
-    dice_regex = r'^(\d+)d(\d+)([+-]\d+)?$'
-    match = re.match(dice_regex, dice_str.strip().lower())
+    match = DICE_RE.match(dice_str.strip().lower())
     if match:
         num_dice = int(match.group(1))
         dice_size = int(match.group(2))
@@ -75,7 +171,6 @@ def revalue_dice(dice_str, old_tier, new_tier):
 
 def retier(stat, new_tier):
     """Placeholder function to perform re-tier calculations."""
-    thresholds_regex = r'^(\d+)/(\d+)$'
     if stat:
         if stat['category']!='Adversaries':
             return None
@@ -91,7 +186,7 @@ def retier(stat, new_tier):
         tier_change_text=["Inferior", "Lesser", "Small", "" , "Large", "Greater", "Superior"][(int(new_tier) - int(old_tier))+3]
         stat['name'] = f"{tier_change_text} {stat['name']}"
         stat['damage_dice'] = revalue_dice(stat['damage_dice'], old_tier, new_tier)
-        match = re.match(thresholds_regex, stat['thresholds'].strip().lower())
+        match = THRESHOLDS_RE.match(stat['thresholds'].strip().lower())
         if match:
             low_threshold = int(match.group(1))
             high_threshold = int(match.group(2))
@@ -112,14 +207,250 @@ def retier(stat, new_tier):
         stat['difficulty']=f"{difficulty}"
 
         for feature in stat["features"]:
-            feature["description"] = re.sub(
-                r'(\d+d\d+[+-]\d+|\d+d\d+)', 
+            feature["description"] = FEATURE_DICE_RE.sub(
                 lambda match: revalue_dice(match.group(0), old_tier, new_tier),
                 feature["description"]
             )
 
     return stat
 
+
+def content_hash(stat):
+    """Returns a hash of a statblock's content."""
+    encoded = json.dumps(stat, sort_keys=True, ensure_ascii=False,
+                         default=lambda o: to_json(o) if isinstance(o, Record) else str(o))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+class RetierCache:
+    """LRU cache of re-tiered statblocks keyed by content hash and new tier.
+
+    Content hashes are remembered per record for the current data version,
+    so a hit costs two dict lookups. Cached results are shared and must not
+    be modified.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.stats = {'hits': 0, 'misses': 0}
+        self._results = OrderedDict()
+        self._hashes = {}
+        self._tag = None
+        self._lock = threading.Lock()
+
+    def _hash(self, data, stat):
+        with self._lock:
+            if self._tag != data.tag:
+                self._tag = data.tag
+                self._hashes = {}
+            hashes = self._hashes
+        key = normalize_name(stat.get('name'))
+        digest = hashes.get(key)
+        if digest is None:
+            digest = hashes[key] = content_hash(stat)
+        return digest
+
+    def retier(self, data, stat, new_tier):
+        """Returns retier() of a copy of stat, or stat itself if it does not change."""
+        key = (self._hash(data, stat), new_tier)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.stats['hits'] += 1
+                return result
+            self.stats['misses'] += 1
+
+        # The stored record is shared, so retier a deep copy of it.
+        result = retier(copy.deepcopy(stat), new_tier) or stat
+        with self._lock:
+            self._results[key] = result
+            if len(self._results) > self.size:
+                self._results.popitem(last=False)
+        return result
+
+    def discard(self, stat):
+        """Drops every cached result for a statblock that is being replaced."""
+        digest = content_hash(stat)
+        with self._lock:
+            for key in [k for k in self._results if k[0] == digest]:
+                del self._results[key]
+
+    def all_tiers(self, data, stat):
+        """Returns the statblock at every tier, keyed by tier."""
+        return {str(tier): self.retier(data, stat, tier) for tier in TIERS}
+
+
+retier_cache = RetierCache(RETIER_CACHE_SIZE)
+
+
+# Patterns used by parse_text_statblock()
+TIER_RE = re.compile(r'Tier (\d+)', re.IGNORECASE)
+TYPE_RES = [(cat, [(t, re.compile(r'\b' + re.escape(t) + r'\b', re.IGNORECASE)) for t in types])
+            for cat, types in CATEGORIES.items()]
+KEY_LINE_RE = re.compile(r'^\w+.*?:')
+ADVERSARY_FEATURE_RE = re.compile(r'^(.*?)\s*(?:\((Action|Reaction|Passive|Evolution|Transformation)\)|[-–]\s*(Action|Reaction|Passive|Evolution|Transformation))\s*:\s*(.*)$', re.IGNORECASE)
+ENVIRONMENT_FEATURE_RE = re.compile(r'^(.*?)\s*(?:\((Action|Reaction|Passive|Evolution|Transformation)\)|–\s*(Action|Reaction|Passive|Evolution|Transformation))\s*:\s*(.*)$', re.IGNORECASE)
+NAMED_LINE_RE = re.compile(r'^(.*?)\s*:\s*(.*)$', re.IGNORECASE)
+DIFFICULTY_LINE_RE = re.compile(r"Difficulty: ?(\d+)\s*\|.*?(\d+\s*/\s*\d+)\s*\|.*?(\d+)\s*\|.*?(\d+)", re.IGNORECASE)
+ATK_LINE_RE = re.compile(r"[Aa][Tt][Kk]:\s*([+-]?\d+)\s*\|\s*(.*?)\s*\|\s*(\S+)\s*(\S+)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=PARSE_LINE_CACHE_SIZE)
+def parse_tier_line(tier_line):
+    """Returns the (key, value) pairs set by the "Tier 1 Solo" line after a statblock's name."""
+    fields = {}
+    tier_match = TIER_RE.search(tier_line)
+    if tier_match:
+        fields['tier'] = int(tier_match.group(1))
+        for cat, types in TYPE_RES:
+            for t, type_re in types:
+                if type_re.search(tier_line):
+                    fields['category'] = cat
+                    fields['type'] = t
+                    break
+    return tuple(fields.items())
+
+
+@functools.lru_cache(maxsize=PARSE_LINE_CACHE_SIZE)
+def parse_stat_line(line):
+    """Returns the (key, value) pairs set by a line before an adversary's features, in order."""
+    fields = {}
+    Difficulty_line_match = DIFFICULTY_LINE_RE.match(line)
+    if Difficulty_line_match:
+        fields['difficulty'] = Difficulty_line_match.group(1).strip()
+        fields['thresholds'] = Difficulty_line_match.group(2).strip()
+        fields['hp'] = Difficulty_line_match.group(3).strip()
+        fields['stress'] =Difficulty_line_match.group(4).strip()
+
+    # Specific parsing for ATK line due to its complex structure
+    atk_line_match = ATK_LINE_RE.search(line)
+    if atk_line_match:
+        fields['atk'] = atk_line_match.group(1).strip()
+        weapon_and_range_str = atk_line_match.group(2).strip()
+
+        # Parse weapon and range from the middle part
+        if ':' in weapon_and_range_str:
+            weapon_parts = weapon_and_range_str.split(':', 1)
+            fields['weapon'] = weapon_parts[0].strip()
+            fields['range'] = weapon_parts[1].strip()
+        else:
+            # Assume last word is range, rest is weapon
+            parts = weapon_and_range_str.rsplit(' ', 1)
+            if len(parts) == 2:
+                fields['weapon'] = parts[0].strip()
+                fields['range'] = parts[1].strip()
+            else: # Only one word, assume it's weapon
+                fields['weapon'] = weapon_and_range_str
+                fields['range'] = '' # Default to empty string if no range found
+
+        fields['damage_dice'] = atk_line_match.group(3).strip()
+        fields['damage_type'] = atk_line_match.group(4).strip()
+        return freeze_fields(fields) # Nothing else on the ATK line
+
+    parts = line.split(':', 1)
+    if len(parts) == 2:
+        key = parts[0].strip().lower().replace(' ', '_')
+        value = parts[1].strip()
+
+        # Mapping for keys that don't directly match the statblock format
+        key_map = {
+            'motives_&_tactics': 'motives_tactics',
+            'difficulty': 'difficulty',
+            'thresholds': 'thresholds',
+            'hp': 'hp',
+            'stress': 'stress',
+            'experience': 'experience',
+            'impulses': 'impulses',
+            'potential_adversaries': 'potential_adversaries',
+        }
+        key = key_map.get(key, key)
+
+        if key in ['motives_tactics', 'impulses', 'experience']:
+            fields[key] = [item.strip() for item in value.split(',')]
+        elif key in ['difficulty', 'thresholds', 'hp', 'stress']:
+            fields[key] = value # Keep as string
+        else:
+            fields[key] = value
+    return freeze_fields(fields)
+
+
+def freeze_fields(fields):
+    """Returns the items of fields with lists made tuples, so cached results cannot be changed."""
+    return tuple((key, tuple(value) if isinstance(value, list) else value) for key, value in fields.items())
+
+
+FEATURE_KEYS = ('name', 'type', 'description')
+
+
+@functools.lru_cache(maxsize=PARSE_LINE_CACHE_SIZE)
+def parse_feature_line(category, line):
+    """Returns (name, type, description) if a line of the features section starts a feature.
+
+    Handles both "Name (Type): ..." and "Name – Type: ...". In environments
+    any other "Name: ..." line starts an Action.
+    """
+    if category == 'Adversaries':
+        feature_match = ADVERSARY_FEATURE_RE.match(line)
+        if feature_match:
+            feature_type = (feature_match.group(2) or feature_match.group(3) or '').strip().capitalize() or 'Passive'
+            return feature_match.group(1).strip(), feature_type, feature_match.group(4).strip()
+        return None
+    feature_match = ENVIRONMENT_FEATURE_RE.match(line)
+    if feature_match:
+        feature_type = (feature_match.group(2) or feature_match.group(3) or '').strip().capitalize()
+        return feature_match.group(1).strip(), feature_type, feature_match.group(4).strip()
+    ick_match = NAMED_LINE_RE.match(line)
+    if ick_match:
+        return ick_match.group(1).strip(), 'Action', ick_match.group(2).strip()
+    return None
+
+
+class ParseCache:
+    """LRU cache of parsed statblocks, for the editor re-submitting the same block.
+
+    Whole submissions are keyed by a hash of their text. The line parsers
+    above keep their own LRU caches, so after editing one line of a block
+    only that line is matched again. Cached results are shared and must not
+    be modified.
+    """
+
+    line_parsers = (parse_tier_line, parse_stat_line, parse_feature_line)
+
+    def __init__(self, size):
+        self.size = size
+        self.stats = {'hits': 0, 'misses': 0}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, text, parse):
+        """Returns parse(text), reusing the result of an earlier call with the same text."""
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.stats['hits'] += 1
+                return result
+            self.stats['misses'] += 1
+
+        result = parse(text)
+        with self._lock:
+            self._results[key] = result
+            if len(self._results) > self.size:
+                self._results.popitem(last=False)
+        return result
+
+    def info(self):
+        """Returns the hit and miss counts of the statblock and line caches."""
+        lines = [parser.cache_info() for parser in self.line_parsers]
+        return dict(self.stats, line_hits=sum(i.hits for i in lines),
+                    line_misses=sum(i.misses for i in lines))
+
+
+parse_cache = ParseCache(PARSE_CACHE_SIZE)
+
+
 def parse_text_statblock(text):
     """Parses a custom text block format into a statblock dictionary."""
     lines = [line.strip() for line in text.split('\n') if line.strip()]
@@ -144,20 +475,13 @@ def parse_text_statblock(text):
     # look for Tier, Type, Category information in the line after the name
     if lines[0].startswith('Tier '):
         tier_line = lines.pop(0)
-        tier_match = re.search(r'Tier (\d+)', tier_line, re.IGNORECASE)
-        if tier_match:
-            stat['tier'] = int(tier_match.group(1))
-            for cat, types in CATEGORIES.items():
-                for t in types:
-                    if re.search(r'\b' + re.escape(t) + r'\b', tier_line, re.IGNORECASE):
-                        stat['category'] = cat
-                        stat['type'] = t
-                        break
+        for key, value in parse_tier_line(tier_line):
+            stat[key] = value
 
     # Description: The first non-empty line after name/tier that doesn't look like a key-value pair or "Features"
     description_lines = []
     # Look for description before processing other key-value pairs
-    while lines and not re.match(r'^\w+.*?:', lines[0]) and not lines[0].lower().startswith('motives') and not lines[0].lower().startswith('impulses'):
+    while lines and not KEY_LINE_RE.match(lines[0]) and not lines[0].lower().startswith('motives') and not lines[0].lower().startswith('impulses'):
         description_lines.append(lines.pop(0))
     if description_lines:
         stat['description'] = " ".join(description_lines).strip()
@@ -185,80 +509,19 @@ def parse_text_statblock(text):
                 continue
 
             if feature_section:
-                # Regex to capture feature name, type, and description
-                # Handles both (Type): and – Type:
-                feature_match = re.match(r'^(.*?)\s*(?:\((Action|Reaction|Passive|Evolution|Transformation)\)|[-–]\s*(Action|Reaction|Passive|Evolution|Transformation))\s*:\s*(.*)$', line, re.IGNORECASE)
-                if feature_match:
+                # Name, type and description if the line starts a feature
+                feature_head = parse_feature_line('Adversaries', line)
+                if feature_head:
                     if current_feature:
                         stat['features'].append(current_feature)
                     
-                    feature_type = (feature_match.group(2) or feature_match.group(3) or '').strip().capitalize() or 'Passive'
-                    current_feature = { # Store as dict
-                        "name": feature_match.group(1).strip(),
-                        "type": feature_type,
-                        "description": feature_match.group(4).strip()
-                    }
+                    current_feature = dict(zip(FEATURE_KEYS, feature_head))
                 elif current_feature:
                     # Append to the description of the current feature
                     current_feature["description"] += f"\n" + line.strip()
             else:
-                # Handle key-value pairs
-                Difficulty_line_match = re.match(r"Difficulty: ?(\d+)\s*\|.*?(\d+\s*/\s*\d+)\s*\|.*?(\d+)\s*\|.*?(\d+)", line, re.IGNORECASE)
-                if Difficulty_line_match:
-                    stat['difficulty'] = Difficulty_line_match.group(1).strip()
-                    stat['thresholds'] = Difficulty_line_match.group(2).strip()
-                    stat['hp'] = Difficulty_line_match.group(3).strip()
-                    stat['stress'] =Difficulty_line_match.group(4).strip()
-
-                # Specific parsing for ATK line due to its complex structure
-                atk_line_match = re.search(r"[Aa][Tt][Kk]:\s*([+-]?\d+)\s*\|\s*(.*?)\s*\|\s*(\S+)\s*(\S+)", line, re.IGNORECASE)
-                if atk_line_match:
-                    stat['atk'] = atk_line_match.group(1).strip()
-                    weapon_and_range_str = atk_line_match.group(2).strip()
-                    
-                    # Parse weapon and range from the middle part
-                    if ':' in weapon_and_range_str:
-                        weapon_parts = weapon_and_range_str.split(':', 1)
-                        stat['weapon'] = weapon_parts[0].strip()
-                        stat['range'] = weapon_parts[1].strip()
-                    else:
-                        # Assume last word is range, rest is weapon
-                        parts = weapon_and_range_str.rsplit(' ', 1)
-                        if len(parts) == 2:
-                            stat['weapon'] = parts[0].strip()
-                            stat['range'] = parts[1].strip()
-                        else: # Only one word, assume it's weapon
-                            stat['weapon'] = weapon_and_range_str
-                            stat['range'] = '' # Default to empty string if no range found
-
-                    stat['damage_dice'] = atk_line_match.group(3).strip()
-                    stat['damage_type'] = atk_line_match.group(4).strip()
-                    continue # Move to next line after parsing ATK
-
-                parts = line.split(':', 1)
-                if len(parts) == 2:
-                    key = parts[0].strip().lower().replace(' ', '_')
-                    value = parts[1].strip()
-                    
-                    # Mapping for keys that don't directly match the statblock format
-                    key_map = {
-                        'motives_&_tactics': 'motives_tactics',
-                        'difficulty': 'difficulty',
-                        'thresholds': 'thresholds',
-                        'hp': 'hp',
-                        'stress': 'stress',
-                        'experience': 'experience',
-                        'impulses': 'impulses',
-                        'potential_adversaries': 'potential_adversaries',
-                    }
-                    key = key_map.get(key, key)
-
-                    if key in ['motives_tactics', 'impulses', 'experience']:
-                        stat[key] = [item.strip() for item in value.split(',')]
-                    elif key in ['difficulty', 'thresholds', 'hp', 'stress']:
-                        stat[key] = value # Keep as string
-                    else:
-                        stat[key] = value
+                for key, value in parse_stat_line(line):
+                    stat[key] = list(value) if isinstance(value, tuple) else value
 
         if current_feature:
             stat['features'].append(current_feature)
@@ -297,29 +560,13 @@ def parse_text_statblock(text):
             elif line_lower.startswith('potential adversaries:'):
                 stat['potential_adversaries'] = line.split(':', 1)[1]
             elif feature_section:
-                # Regex to capture feature name, type, and description
-                # Handles both (Type): and – Type:
-                feature_match = re.match(r'^(.*?)\s*(?:\((Action|Reaction|Passive|Evolution|Transformation)\)|–\s*(Action|Reaction|Passive|Evolution|Transformation))\s*:\s*(.*)$', line, re.IGNORECASE)
-                ick_match = re.match(r'^(.*?)\s*:\s*(.*)$', line, re.IGNORECASE)    
-                if feature_match:
-                    if current_feature:
-                        stat['features'].append(current_feature)
-                    
-                    feature_type = (feature_match.group(2) or feature_match.group(3) or '').strip().capitalize()
-                    current_feature = { # Store as dict
-                        "name": feature_match.group(1).strip(),
-                        "type": feature_type,
-                        "description": feature_match.group(4).strip()
-                    }
-                elif ick_match:
+                # Name, type and description if the line starts a feature
+                feature_head = parse_feature_line('Environments', line)
+                if feature_head:
                     if current_feature:
                         stat['features'].append(current_feature)
                     
-                    current_feature = { # Store as dict
-                        "name": ick_match.group(1).strip(),
-                        "type": 'Action',
-                        "description": ick_match.group(2).strip()
-                    }
+                    current_feature = dict(zip(FEATURE_KEYS, feature_head))
 
                 elif current_feature:
                     # Append to the description of the current feature
@@ -343,42 +590,52 @@ def parse_text_statblock(text):
 def load_statblock(text):
     try:
         statblock = json.loads(text)
-        # Transform "attacks" array if it exists
-        if 'attacks' in statblock and isinstance(statblock['attacks'], list) and statblock['attacks']:
-            attack = statblock['attacks'][0]
-            
-            statblock['weapon'] = attack.get('name')
-            
-            attack_bonus = attack.get('attack_bonus', 0)
-            if isinstance(attack_bonus, (int, float)):
-                 statblock['atk'] = f"{'+' if attack_bonus > 0 else ''}{attack_bonus}"
-            else:
-                 statblock['atk'] = str(attack_bonus)
-
-            statblock['damage_dice'] = attack.get('damage')
-            statblock['damage_type'] = attack.get('damage_type')
-            statblock['range'] = attack.get('range')
-            del statblock['attacks']
-
-        # Transform "effect" to "description" in features
-        if 'features' in statblock and isinstance(statblock['features'], list):
-            for feature in statblock['features']:
-                if 'effect' in feature:
-                    feature['description'] = feature.pop('effect')
-
-        # Transform "experiences" array to "experience"
-        if 'experiences' in statblock and isinstance(statblock['experiences'], list):
-            new_experience = []
-            for exp in statblock['experiences']:
-                name = exp.get('name', '')
-                value = exp.get('value', '')
-                new_experience.append(f"{name} {value}".strip())
-            statblock['experience'] = new_experience
-            del statblock['experiences']
-
-        return statblock
     except json.JSONDecodeError:
         return parse_text_statblock(text)
+    return convert_json_statblock(statblock)
+
+def parse_card(card):
+    """Parses one card of a bulk import, either a JSON dict or statblock text."""
+    if isinstance(card, dict):
+        return convert_json_statblock(card)
+    return load_statblock(card)
+
+def convert_json_statblock(statblock):
+    """Converts a statblock in the exported JSON format to the stored format."""
+    # Transform "attacks" array if it exists
+    if 'attacks' in statblock and isinstance(statblock['attacks'], list) and statblock['attacks']:
+        attack = statblock['attacks'][0]
+        
+        statblock['weapon'] = attack.get('name')
+        
+        attack_bonus = attack.get('attack_bonus', 0)
+        if isinstance(attack_bonus, (int, float)):
+             statblock['atk'] = f"{'+' if attack_bonus > 0 else ''}{attack_bonus}"
+        else:
+             statblock['atk'] = str(attack_bonus)
+
+        statblock['damage_dice'] = attack.get('damage')
+        statblock['damage_type'] = attack.get('damage_type')
+        statblock['range'] = attack.get('range')
+        del statblock['attacks']
+
+    # Transform "effect" to "description" in features
+    if 'features' in statblock and isinstance(statblock['features'], list):
+        for feature in statblock['features']:
+            if 'effect' in feature:
+                feature['description'] = feature.pop('effect')
+
+    # Transform "experiences" array to "experience"
+    if 'experiences' in statblock and isinstance(statblock['experiences'], list):
+        new_experience = []
+        for exp in statblock['experiences']:
+            name = exp.get('name', '')
+            value = exp.get('value', '')
+            new_experience.append(f"{name} {value}".strip())
+        statblock['experience'] = new_experience
+        del statblock['experiences']
+
+    return statblock
 
 @app.route('/')
 def index():
@@ -395,60 +652,166 @@ def update():
 def api_types():
     category = request.args.get('category', '')
     types = CATEGORIES.get(category, [])
-    return jsonify({'types': types})
+    return cached_response(current_data(), lambda: jsonify({'types': types}))
+
+
+_response_cache = {'tag': None, 'bodies': OrderedDict()}
+_response_cache_lock = threading.Lock()
+
+
+def cached_response(data, build):
+    """Serves a read endpoint with HTTP caching tied to the data version.
+
+    The response gets an ETag and Last-Modified from the snapshot, and a
+    matching If-None-Match or If-Modified-Since gets a 304 without building
+    the body. Bodies are kept per URL until the data changes, so repeated
+    polls are not serialized again. build returns the uncached response;
+    anything but a 200 is passed through uncached.
+    """
+    tag = data.tag
+    if request.if_none_match.contains(tag):
+        response = app.response_class(status=304)
+    else:
+        key = request.full_path
+        with _response_cache_lock:
+            if _response_cache['tag'] != tag:
+                _response_cache['tag'] = tag
+                _response_cache['bodies'] = OrderedDict()
+            bodies = _response_cache['bodies']
+            cached = bodies.get(key)
+            if cached is not None:
+                bodies.move_to_end(key)
+
+        if cached is None:
+            built = build()
+            if isinstance(built, tuple) or built.status_code != 200:
+                return built
+            headers = [(k, v) for k, v in built.headers if k != 'Content-Length']
+            cached = (built.get_data(), headers)
+            with _response_cache_lock:
+                if _response_cache['tag'] == tag:
+                    bodies[key] = cached
+                    if len(bodies) > RESPONSE_CACHE_SIZE:
+                        bodies.popitem(last=False)
+        response = app.response_class(cached[0], headers=cached[1])
+
+    response.set_etag(tag)
+    response.last_modified = datetime.fromtimestamp(data.modified, timezone.utc)
+    if CACHE_MAX_AGE:
+        response.cache_control.public = True
+        response.cache_control.max_age = CACHE_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def list_options(source, default_fields):
+    """Reads the paging, projection and format options of a list endpoint.
+
+    source is the query string or the JSON payload. Returns the options as
+    a dict, or an error response if one of them cannot be read.
+    """
+    try:
+        offset = max(int(source.get('offset') or 0), 0)
+        limit = source.get('limit')
+        limit = max(int(limit), 0) if limit not in (None, '') else None
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'limit and offset must be integers'}), 400)
+
+    fields = source.get('fields') or default_fields
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+    elif not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+        return None, (jsonify({'error': 'fields must be a list of strings or a comma-separated string'}), 400)
+
+    stream = (source.get('format') == 'ndjson'
+              or request.accept_mimetypes.best == 'application/x-ndjson')
+    return {'offset': offset, 'limit': limit, 'fields': fields, 'stream': stream}, None
+
+
+def project(s, fields):
+    return {key: s.get(key, '') for key in fields}
+
+
+def stream_ndjson(records, fields, total):
+    """Streams the projected records as newline-delimited JSON."""
+    def generate():
+        for s in records:
+            yield json.dumps(project(s, fields), ensure_ascii=False, default=to_json) + '\n'
+    return app.response_class(generate(), mimetype='application/x-ndjson',
+                              headers={'X-Total-Count': str(total)})
+
+
+def list_category(category):
+    """Builds the /api/adversaries or /api/environments response."""
+    options, error = list_options(request.args, ['name', 'tier', 'type', 'description'])
+    if error:
+        return error
+
+    data = current_data()
+    if options['stream']:
+        with metrics.span('filter'):
+            records, _, total = data.search(category, offset=options['offset'], limit=options['limit'])
+        return stream_ndjson(records, options['fields'], total)
+
+    def build():
+        with metrics.span('filter'):
+            records, _, total = data.search(category, offset=options['offset'], limit=options['limit'])
+        response = serialize([project(s, options['fields']) for s in records])
+        response.headers['X-Total-Count'] = str(total)
+        return response
+    return cached_response(data, build)
 
 
 @app.route('/api/search', methods=['POST'])
 def api_search():
-    data = load_data()
+    data = current_data()
     payload = request.get_json() or {}
     category = (payload.get('category') or '').strip()
     tier = payload.get('tier')
     type_ = (payload.get('type') or '').strip()
     text = (payload.get('text') or '').strip().lower()
+    mode = payload.get('mode') or 'substring'
+    options, error = list_options(payload, ['name', 'tier', 'type', 'category', 'description'])
+    if error:
+        return error
+    if mode not in ('substring', 'ranked'):
+        return jsonify({'error': 'mode must be substring or ranked'}), 400
+
+    if mode == 'ranked' and text:
+        limit = options['limit'] if options['limit'] is not None else RANKED_LIMIT
+        with metrics.span('filter'):
+            ranked, facets, total = data.rank(text, category, tier, type_,
+                                              offset=options['offset'], limit=limit)
+        matches = [dict(s, score=score) for s, score in ranked]
+        options['fields'] = options['fields'] + ['score']
+    else:
+        with metrics.span('filter'):
+            matches, facets, total = data.search(category, tier, type_, text,
+                                                 offset=options['offset'], limit=options['limit'])
+    if options['stream']:
+        return stream_ndjson(matches, options['fields'], total)
 
-    results = []
-    for s in data:
-        if category and s.get('category') != category:
-            continue
-        if tier:
-            try:
-                if int(s.get('tier')) != int(tier):
-                    continue
-            except Exception:
-                continue
-        if type_ and s.get('type') != type_:
-            continue
-        if text:
-            # Build a searchable string from all relevant fields
-            haystack_fields = ['name', 'description', 'type']
-            hay = ' '.join([str(s.get(field, '')) for field in haystack_fields]).lower()
-
-            if s.get('category') == 'Adversaries':
-                adversary_fields = ['motives_tactics']
-                hay += ' ' + ' '.join([str(s.get(field, '')) for field in adversary_fields]).lower()
-                weapon_fields = ['weapon', 'damage_type']
-                hay += ' ' + ' '.join([str(s.get(field, '')) for field in weapon_fields]).lower()
-            elif s.get('category') == 'Environments':
-                environment_fields = ['impulses', 'potential_adversaries']
-                hay += ' ' + ' '.join([str(s.get(field, '')) for field in environment_fields]).lower()
-
-            # Include features in search
-            for f in s.get('features', []):
-                hay += f" {str(f.get('name','')).lower()} {str(f.get('description','')).lower()}"
-
-            if text not in hay:
-                continue
+    results = [project(s, options['fields']) for s in matches]
+    return serialize({'results': results, 'facets': facets, 'total': total})
 
-        results.append({
-            'name': s.get('name', ''),
-            'tier': s.get('tier', ''),
-            'type': s.get('type', ''),
-            'category': s.get('category', ''),
-            'description': s.get('description','')
-        })
 
-    return jsonify({'results': results})
+@app.route('/api/suggest')
+def api_suggest():
+    """Returns card and feature names starting with q, for typeahead."""
+    try:
+        limit = int(request.args.get('limit') or SUGGEST_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    limit = min(max(limit, 0), MAX_SUGGEST_LIMIT)
+    q = request.args.get('q', '')
+    data = current_data()
+
+    def build():
+        with metrics.span('filter'):
+            found = data.suggest(q, limit)
+        return serialize({'q': q, 'suggestions': [{'name': name, 'kind': kind} for kind, name in found]})
+    return cached_response(data, build)
 
 
 # --- External APIs ---
@@ -456,36 +819,22 @@ def api_search():
 @app.route('/api/adversaries')
 def api_adversaries():
     """Returns a list of all adversaries with basic information."""
-    data = load_data()
-    adversaries = [
-        {
-            'name': s.get('name', ''),
-            'tier': s.get('tier', ''),
-            'type': s.get('type', ''),
-            'description': s.get('description', '')
-        }
-        for s in data if s.get('category') == 'Adversaries'
-    ]
-    return jsonify(adversaries)
+    return list_category('Adversaries')
 
 
 @app.route('/api/environments')
 def api_environments():
     """Returns a list of all environments with basic information."""
-    data = load_data()
-    environments = [
-        {key: s.get(key, '') for key in ['name', 'tier', 'type', 'description']}
-        for s in data if s.get('category') == 'Environments'
-    ]
-    return jsonify(environments)
+    return list_category('Environments')
 
 @app.route('/api/stat/<path:name>')
 def api_stat(name):
-    data = load_data()
-    found = find_stat(data, name)
+    data = current_data()
+    with metrics.span('filter'):
+        found = find_stat(data, name)
     if not found:
         return jsonify({'error': 'Not found'}), 404
-    return jsonify(found)
+    return cached_response(data, lambda: serialize(found))
 
 
 @app.route('/api/retier', methods=['POST'])
@@ -497,14 +846,267 @@ def api_retier():
 
     if not name or not new_tier:
         return jsonify({'error': 'Name and new_tier are required'}), 400
+    if parse_tier(new_tier) is None:
+        return jsonify({'error': TIER_ERROR}), 400
 
-    data = load_data()
-    stat = find_stat(data, name)
+    data = current_data()
+    try:
+        stat = retier_stat(data, name, new_tier)
+    except RETIER_ERRORS:
+        return jsonify({'error': 'Could not retier this statblock'}), 400
     if not stat:
         return jsonify({'error': 'Not found'}), 404
+    return serialize(stat)
+
+
+def parse_tier(value):
+    """Returns a requested tier as an int, or None if it is not one of TIERS."""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    return value if type(value) is int and value in TIERS else None
+
+
+def retier_stat(data, name, new_tier):
+    """Returns the named statblock re-tiered, or None if there is no such statblock."""
+    with metrics.span('filter'):
+        stat = find_stat(data, name)
+    if not stat:
+        return None
+    with metrics.span('retier'):
+        return retier_cache.retier(data, stat, new_tier)
+
+
+@app.route('/api/tiers/<path:name>')
+def api_tiers(name):
+    """Returns a statblock re-tiered to every tier."""
+    data = current_data()
+    with metrics.span('filter'):
+        stat = find_stat(data, name)
+    if not stat:
+        return jsonify({'error': 'Not found'}), 404
+    if stat.get('category') != 'Adversaries':
+        return jsonify({'error': 'Not an adversary'}), 400
+
+    def build():
+        with metrics.span('retier'):
+            try:
+                tiers = retier_cache.all_tiers(data, stat)
+            except RETIER_ERRORS:
+                return jsonify({'error': 'Could not retier this statblock'}), 400
+        return serialize(tiers)
+    return cached_response(data, build)
+
+
+def batch_items(payload, key):
+    """Returns the list under key in a batch request, or an error response."""
+    items = payload.get(key)
+    if not isinstance(items, list):
+        return None, (jsonify({'error': f'{key} must be a list'}), 400)
+    if len(items) > MAX_BATCH:
+        return None, (jsonify({'error': f'At most {MAX_BATCH} {key} per request'}), 400)
+    return items, None
+
+
+@app.route('/api/stats', methods=['POST'])
+def api_stats():
+    """Returns the statblocks for a list of names."""
+    payload = request.get_json() or {}
+    names, error = batch_items(payload, 'names')
+    if error:
+        return error
+
+    data = current_data()
+    results = []
+    with metrics.span('filter'):
+        for name in names:
+            stat = find_stat(data, name) if isinstance(name, str) and name.strip() else None
+            if stat:
+                results.append({'name': name, 'stat': stat})
+            else:
+                results.append({'name': name, 'error': 'Not found'})
+    return serialize({'results': results})
+
+
+@app.route('/api/retier/batch', methods=['POST'])
+def api_retier_batch():
+    """Re-tiers a list of statblocks against the same data."""
+    payload = request.get_json() or {}
+    items, error = batch_items(payload, 'items')
+    if error:
+        return error
+
+    data = current_data()
+    results = []
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        name = item.get('name')
+        new_tier = item.get('new_tier')
+        result = {'name': name, 'new_tier': new_tier}
+        if not isinstance(name, str) or not name.strip() or not new_tier:
+            result['error'] = 'Name and new_tier are required'
+        elif parse_tier(new_tier) is None:
+            result['error'] = TIER_ERROR
+        else:
+            try:
+                stat = retier_stat(data, name.strip(), new_tier)
+            except RETIER_ERRORS:
+                result['error'] = 'Could not retier this statblock'
+            else:
+                if stat:
+                    result['stat'] = stat
+                else:
+                    result['error'] = 'Not found'
+        results.append(result)
+    return serialize({'results': results})
+
+
+POTENTIAL_GROUP_RE = re.compile(r'^(.*?)\s*\((.*)\)\s*$')
+
+
+def split_top_level(text):
+    """Splits text on the commas that are not inside parentheses."""
+    parts = []
+    depth = 0
+    start = 0
+    for i, ch in enumerate(text):
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth = max(depth - 1, 0)
+        elif ch == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def potential_adversaries(data, value):
+    """Looks up the statblocks named by an environment's potential_adversaries.
+
+    Names may be grouped, as in 'Jagged Knife Bandits (Hexer, Lackey)'; a
+    grouped name is tried on its own, then after the leading words of the
+    group name, so Hexer finds Jagged Knife Hexer. Returns the statblocks
+    found, in the order named, and the names that matched nothing.
+    """
+    if isinstance(value, list):
+        value = ', '.join(str(v) for v in value)
+    found = []
+    unmatched = []
+    seen = set()
+    for part in split_top_level(str(value or '')):
+        match = POTENTIAL_GROUP_RE.match(part)
+        if match:
+            group = match.group(1).split()
+            names = split_top_level(match.group(2))
+        else:
+            group = []
+            names = [part]
+        for name in names:
+            candidates = [name] + [' '.join(group[:i] + [name]) for i in range(len(group), 0, -1)]
+            stat = next((s for s in (find_stat(data, c) for c in candidates) if s), None)
+            if stat is None:
+                unmatched.append(name)
+            elif normalize_name(stat.get('name')) not in seen:
+                seen.add(normalize_name(stat.get('name')))
+                found.append(stat)
+    return found, unmatched
+
+
+def stat_number(value):
+    """Returns a statblock number such as hp or difficulty as an int, or None."""
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def encounter_stat(data, name, tier):
+    """Returns (statblock, error) for one adversary of an encounter, re-tiered if tier is set."""
+    if tier:
+        try:
+            stat = retier_stat(data, name, tier)
+        except RETIER_ERRORS:
+            return None, 'Could not retier this statblock'
+    else:
+        with metrics.span('filter'):
+            stat = find_stat(data, name)
+    if not stat:
+        return None, 'Not found'
+    if stat.get('category') != 'Adversaries':
+        return None, 'Not an adversary'
+    return stat, None
+
+
+def add_to_totals(totals, stat, count):
+    """Adds count copies of an adversary to the encounter totals."""
+    totals['adversaries'] += count
+    for field in ('hp', 'stress'):
+        totals[field] += (stat_number(stat.get(field)) or 0) * count
+    difficulty = stat_number(stat.get('difficulty'))
+    if difficulty is not None:
+        current = totals['difficulty']
+        totals['difficulty'] = {'min': difficulty, 'max': difficulty} if current is None else {
+            'min': min(current['min'], difficulty), 'max': max(current['max'], difficulty)}
+    for field, key in (('tiers', str(stat.get('tier'))), ('types', str(stat.get('type')))):
+        totals[field][key] = totals[field].get(key, 0) + count
+
+
+@app.route('/api/encounter', methods=['POST'])
+def api_encounter():
+    """Builds an encounter: the re-tiered adversaries, their totals and suggestions."""
+    payload = request.get_json() or {}
+    items, error = batch_items(payload, 'adversaries')
+    if error:
+        return error
+    default_tier = payload.get('tier')
+    if default_tier and parse_tier(default_tier) is None:
+        return jsonify({'error': f'tier must be one of {TIER_CHOICES}'}), 400
+
+    data = current_data()
+    # Each (card, tier) is looked up and re-tiered once, however often it is listed
+    computed = {}
+    adversaries = []
+    totals = {'adversaries': 0, 'hp': 0, 'stress': 0, 'difficulty': None, 'tiers': {}, 'types': {}}
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        name = item.get('name')
+        tier = item.get('tier') or default_tier
+        count = item.get('count', 1)
+        entry = {'name': name, 'count': count}
+        if not isinstance(name, str) or not name.strip():
+            entry['error'] = 'Name is required'
+        elif not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            entry['error'] = 'count must be a positive integer'
+        elif tier and parse_tier(tier) is None:
+            entry['error'] = f'tier must be one of {TIER_CHOICES}'
+        else:
+            key = (normalize_name(name), str(tier) if tier else None)
+            if key not in computed:
+                computed[key] = encounter_stat(data, name.strip(), tier)
+            stat, entry_error = computed[key]
+            if entry_error:
+                entry['error'] = entry_error
+            else:
+                entry['tier'] = stat_number(stat.get('tier'))
+                entry['stat'] = stat
+                add_to_totals(totals, stat, count)
+        adversaries.append(entry)
+
+    result = {'adversaries': adversaries, 'totals': totals}
+    environment = payload.get('environment')
+    if environment:
+        with metrics.span('filter'):
+            env = find_stat(data, environment) if isinstance(environment, str) else None
+            if env and env.get('category') == 'Environments':
+                suggested, unmatched = potential_adversaries(data, env.get('potential_adversaries'))
+                result['environment'] = env
+                result['suggestions'] = [project(s, ['name', 'tier', 'type', 'difficulty', 'hp'])
+                                         for s in suggested]
+                result['unmatched'] = unmatched
+            else:
+                result['environment'] = {'name': environment, 'error': 'Not found'}
+    return serialize(result)
 
-    modified_stat = retier(stat.copy(), new_tier)
-    return jsonify(modified_stat or stat)
 
 @app.route('/api/load_statblock', methods=['POST'])
 def api_load_statblock():
@@ -516,8 +1118,45 @@ def api_load_statblock():
     if not text:
         return jsonify({'error': 'Text is required'}), 400
     
-    statblock = load_statblock(text)
-    return jsonify(statblock)
+    with metrics.span('parse'):
+        statblock = parse_cache.load(text, load_statblock)
+    return serialize(statblock)
+
+@app.route('/api/import', methods=['POST'])
+def api_import():
+    """
+    Parses many statblocks from a text, JSON or NDJSON document and saves them in one write.
+    """
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict) and 'text' in payload:
+        text = payload.get('text') or ''
+        dry_run = bool(payload.get('dry_run'))
+        if not isinstance(text, str):
+            return jsonify({'error': 'text must be a string'}), 400
+    else:
+        text = request.get_data(as_text=True)
+        dry_run = request.args.get('dry_run') in ('1', 'true')
+    if not text.strip():
+        return jsonify({'error': 'Text is required'}), 400
+
+    try:
+        summary = run_import(iter_cards(text.splitlines(keepends=True)), parse_card,
+                             None if dry_run else save_imported)
+    except ValueError as e:
+        return jsonify({'error': f'Could not read the statblocks: {e}'}), 400
+    summary['saved'] = not dry_run and bool(summary['imported'])
+    return jsonify(summary)
+
+
+def save_imported(items):
+    snap = current_data()
+    for name, _ in items:
+        existing = find_stat(snap, name)
+        if existing:
+            retier_cache.discard(existing)
+    with metrics.span('save'):
+        store.upsert_many(items)
+
 
 @app.route('/api/save', methods=['POST'])
 def api_save():
@@ -527,12 +1166,6 @@ def api_save():
     if not name:
         return jsonify({'error': 'Name is required'}), 400
 
-    data = load_data()
-    existing = find_stat(data, name)
-    if existing:
-        # overwrite
-        data = [s for s in data if s.get('name','').strip().lower() != name.lower()]
-    
     category = payload.get('category')
     stat = {}
 
@@ -569,10 +1202,99 @@ def api_save():
             'features': payload.get('features', [])
         }
 
-    data.append(stat)
-    save_data(data)
+    existing = find_stat(current_data(), name)
+    if existing:
+        retier_cache.discard(existing)
+    # Overwrites any existing statblock with the same name
+    with metrics.span('save'):
+        store.upsert(name, stat)
     return jsonify({'saved': True})
 
 
+def parse_since(value):
+    """Reads the since version of a /api/changes request; None means only new saves.
+
+    Raises ValueError if it is not an integer.
+    """
+    return int(value) if value not in (None, '') else None
+
+
+def parse_poll_timeout(value):
+    """Reads the timeout of a /api/changes long poll; raises ValueError if it is not a finite number."""
+    timeout = float(value) if value not in (None, '') else CHANGES_LONG_POLL
+    if not math.isfinite(timeout):
+        raise ValueError(f'timeout must be finite: {value}')
+    return min(max(timeout, 0), CHANGES_LONG_POLL)
+
+
+def change_events(latest, changes):
+    """Formats the result of store.changes_since() as server-sent events."""
+    if changes is None:
+        data = json.dumps({'version': latest})
+        return f"event: reset\nid: {latest}\ndata: {data}\n\n"
+    events = []
+    for seq, name in changes:
+        data = json.dumps({'name': name, 'version': seq}, ensure_ascii=False)
+        events.append(f"event: change\nid: {seq}\ndata: {data}\n\n")
+    return ''.join(events)
+
+
+def changes_payload(latest, changes):
+    """Formats the result of store.changes_since() as a long poll response."""
+    return {
+        'version': latest,
+        'reset': changes is None,
+        'changes': [{'name': name, 'version': seq} for seq, name in changes or []],
+    }
+
+
+@app.route('/api/changes')
+def api_changes():
+    """Streams the names of saved statblocks as server-sent events."""
+    try:
+        since = parse_since(request.args.get('since') or request.headers.get('Last-Event-ID'))
+    except ValueError:
+        return jsonify({'error': 'since must be an integer'}), 400
+
+    if request.args.get('format') == 'json':
+        try:
+            timeout = parse_poll_timeout(request.args.get('timeout'))
+        except ValueError:
+            return jsonify({'error': 'timeout must be a number'}), 400
+        return jsonify(changes_payload(*store.wait_for_change(since, timeout, WATCH_INTERVAL)))
+
+    def generate():
+        latest, changes = store.changes_since(since)
+        yield change_events(latest, changes)
+        # Gives the client the version to reconnect from
+        yield f"event: ready\nid: {latest}\ndata: {json.dumps({'version': latest})}\n\n"
+        version = latest
+        while True:
+            latest, changes = store.wait_for_change(version, CHANGES_HEARTBEAT, WATCH_INTERVAL)
+            if changes is None or changes:
+                yield change_events(latest, changes)
+                version = latest
+            else:
+                yield ': keep-alive\n\n'
+
+    return app.response_class(generate(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/store/stats')
+def api_store_stats():
+    """Returns the data store, retier cache and parse cache counters."""
+    info = store.info()
+    info['retier_cache'] = dict(retier_cache.stats)
+    info['parse_cache'] = parse_cache.info()
+    return jsonify(info)
+
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Returns the request and phase timings in the Prometheus text format."""
+    return app.response_class(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8282, debug=True)
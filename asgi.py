@@ -0,0 +1,319 @@
+"""Asyncio (ASGI) entry point for the codex.
+
+Connections are held by the event loop, so hundreds of clients can keep
+connections open and poll without each tying up a thread. Each request is
+handled by the same Flask routes as under WSGI, run on a bounded pool of
+threads together with their file I/O, so responses are identical.
+
+    python asgi.py --workers 2 --threads 16
+
+Needs uvicorn for the command above; any other ASGI server can load
+asgi:app, for example hypercorn asgi:app.
+"""
+import io
+import os
+import sys
+import json
+import asyncio
+import argparse
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import app as codex
+
+# Threads running requests per process
+THREADS = int(os.environ.get("CODEX_THREADS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='codex-asgi')
+
+
+def build_environ(scope, body):
+    """Builds the WSGI environ for an ASGI HTTP request."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = name
+        else:
+            key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    environ.setdefault('CONTENT_LENGTH', str(len(body)))
+    return environ
+
+
+def call_wsgi(environ):
+    """Runs a request through the Flask app.
+
+    Returns the status, the headers, the body chunks read so far and the
+    rest of the body. Responses with a Content-Length are read completely
+    here; streamed ones are left to be read chunk by chunk.
+    """
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    iterable = codex.app.wsgi_app(environ, start_response)
+    iterator = iter(iterable)
+    chunks = []
+    try:
+        sized = any(name.lower() == 'content-length' for name, _ in started['headers'])
+        if sized:
+            chunks = list(iterator)
+    except BaseException:
+        _close(iterable)
+        raise
+    if sized:
+        _close(iterable)
+        return started['status'], started['headers'], chunks, None
+    return started['status'], started['headers'], chunks, (iterable, iterator)
+
+
+def _close(iterable):
+    close = getattr(iterable, 'close', None)
+    if close is not None:
+        close()
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def http(scope, receive, send):
+    body = await read_body(receive)
+    if body is None:
+        return
+    loop = asyncio.get_running_loop()
+    status, headers, chunks, rest = await loop.run_in_executor(
+        _executor, call_wsgi, build_environ(scope, body))
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers],
+    })
+    if rest is None:
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+        return
+
+    iterable, iterator = rest
+    done = object()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(_executor, next, iterator, done)
+            if chunk is done:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        await loop.run_in_executor(_executor, _close, iterable)
+
+
+class ChangeFeed:
+    """Wakes this process's /api/changes clients when the data version moves.
+
+    Saves made in this process wake them straight away; saves by other
+    processes are noticed by checking the version every WATCH_INTERVAL.
+    Waiting clients hold no thread.
+    """
+
+    def __init__(self):
+        self.latest = None
+        self._event = None
+        self._task = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        codex.store.add_listener(lambda: loop.call_soon_threadsafe(self._wake))
+        self._task = loop.create_task(self._poll())
+
+    def _wake(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                latest, _ = await loop.run_in_executor(_executor, codex.store.changes_since, None)
+            except Exception:
+                latest = self.latest
+            if latest != self.latest:
+                self.latest = latest
+                self._wake()
+            await asyncio.sleep(codex.WATCH_INTERVAL)
+
+    async def wait(self, timeout):
+        """Waits up to timeout seconds for the next change."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+change_feed = ChangeFeed()
+
+
+async def send_json(send, status, value):
+    body = json.dumps(value).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def changes(scope, receive, send):
+    """Serves /api/changes like the Flask route, waiting on the event loop."""
+    change_feed.start()
+    loop = asyncio.get_running_loop()
+    params = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+               for name, value in scope.get('headers', [])}
+    try:
+        since = codex.parse_since(params.get('since', [''])[0] or headers.get('last-event-id'))
+    except ValueError:
+        return await send_json(send, 400, {'error': 'since must be an integer'})
+
+    def changes_since(version):
+        return loop.run_in_executor(_executor, codex.store.changes_since, version)
+
+    if params.get('format', [''])[0] == 'json':
+        try:
+            timeout = codex.parse_poll_timeout(params.get('timeout', [''])[0])
+        except ValueError:
+            return await send_json(send, 400, {'error': 'timeout must be a number'})
+        deadline = loop.time() + timeout
+        while True:
+            latest, found = await changes_since(since)
+            remaining = deadline - loop.time()
+            if found is None or found or remaining <= 0:
+                return await send_json(send, 200, codex.changes_payload(latest, found))
+            await change_feed.wait(min(codex.WATCH_INTERVAL, remaining))
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def stream():
+        async def event(text):
+            await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+        latest, found = await changes_since(since)
+        await event(codex.change_events(latest, found))
+        await event(f"event: ready\nid: {latest}\ndata: {json.dumps({'version': latest})}\n\n")
+        version = latest
+        idle = 0.0
+        while True:
+            wait = min(codex.WATCH_INTERVAL, codex.CHANGES_HEARTBEAT - idle)
+            await change_feed.wait(wait)
+            latest, found = await changes_since(version)
+            if found is None or found:
+                await event(codex.change_events(latest, found))
+                version = latest
+                idle = 0.0
+            else:
+                idle += wait
+                if idle >= codex.CHANGES_HEARTBEAT:
+                    await event(': keep-alive\n\n')
+                    idle = 0.0
+
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                            (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')]})
+    tasks = [asyncio.ensure_future(stream()), asyncio.ensure_future(disconnected())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await loop.run_in_executor(_executor, codex.preload_data)
+                codex.store.start_watcher(codex.WATCH_INTERVAL)
+                change_feed.start()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        if scope['path'] == '/api/changes' and scope['method'] == 'GET':
+            await changes(scope, receive, send)
+        else:
+            await http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    else:
+        raise NotImplementedError(f"Unsupported ASGI scope type: {scope['type']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the codex with an asyncio (ASGI) server.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8282)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('CODEX_WORKERS', '1')),
+                        help='Worker processes')
+    parser.add_argument('--threads', type=int, default=THREADS,
+                        help='Threads running requests in each worker process')
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error('Install uvicorn to serve the codex with asyncio, or load asgi:app '
+                     'with another ASGI server')
+    # Worker processes import this module afresh and read the thread count from here
+    os.environ['CODEX_THREADS'] = str(args.threads)
+    uvicorn.run('asgi:app', host=args.host, port=args.port, workers=args.workers,
+                lifespan='on')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""Throughput benchmarks for parsing, search, lookup, retier and saving.
+
+Scales data/statblocks_default.json up to the requested catalog sizes,
+renders the cards to the text statblock format, and times each operation
+at each size. Every operation's output is hashed and checked against the
+golden results in benchmarks/golden.json, so a speed-up that changes
+results shows up as a mismatch.
+
+    python -m benchmarks.bench --sizes 10000,100000 --output results.json
+    python -m benchmarks.bench --compare results.json
+"""
+import os
+import sys
+import copy
+import json
+import time
+import hashlib
+import platform
+import argparse
+import tempfile
+
+import app
+from store import Snapshot, StatblockStore
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_FILE = os.path.join(BENCH_DIR, 'golden.json')
+
+SEARCH_QUERIES = [
+    {'text': 'flicker'},
+    {'text': 'mark a stress'},
+    {'text': 'd8+3'},
+    {'text': 'bear', 'category': 'Adversaries'},
+    {'category': 'Adversaries', 'tier': 2},
+    {'category': 'Environments', 'type': 'Event'},
+    {'tier': 4, 'type': 'Solo'},
+    {'text': 'within close range', 'tier': 3},
+]
+# Cards used for the per-card operations at every size
+SAMPLE_SIZE = 500
+SAVES = 50
+
+
+def scale_corpus(records, size):
+    """Returns size statblocks made by cycling through records.
+
+    Copies after the first round get a numbered name so every name stays
+    unique.
+    """
+    corpus = []
+    for i in range(size):
+        stat = copy.deepcopy(records[i % len(records)])
+        if i >= len(records):
+            stat['name'] = f"{stat['name']} {i // len(records)}"
+        corpus.append(stat)
+    return corpus
+
+
+def render_text_statblock(s):
+    """Renders a statblock in the text format read by parse_text_statblock()."""
+    lines = [s['name'], f"Tier {s.get('tier')} {s.get('type')}", s.get('description') or '']
+    if s.get('category') == 'Adversaries':
+        lines.append('Motives & Tactics: ' + ', '.join(s.get('motives_tactics') or []))
+        lines.append(f"Difficulty: {s.get('difficulty')} | Thresholds: {s.get('thresholds')} "
+                     f"| HP: {s.get('hp')} | Stress: {s.get('stress')}")
+        lines.append(f"ATK: {s.get('atk')} | {s.get('weapon')}: {s.get('range')} "
+                     f"| {s.get('damage_dice')} {s.get('damage_type')}")
+        if s.get('experience'):
+            lines.append('Experience: ' + ', '.join(s['experience']))
+    else:
+        lines.append('Impulses: ' + ', '.join(s.get('impulses') or []))
+        lines.append(f"Difficulty: {s.get('difficulty')}")
+        lines.append(f"Potential Adversaries: {s.get('potential_adversaries')}")
+    lines.append('Features')
+    for f in s.get('features', []):
+        lines.append(f"{f.get('name')} - {f.get('type')}: {f.get('description')}")
+    return '\n'.join(lines)
+
+
+def digest(value):
+    encoded = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def timed(fn, repeat=1):
+    """Runs fn repeat times, returning the last result and the best time."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def sample(corpus):
+    step = max(len(corpus) // SAMPLE_SIZE, 1)
+    return corpus[::step][:SAMPLE_SIZE]
+
+
+def bench_parse(corpus):
+    texts = [render_text_statblock(s) for s in corpus]
+    parsed, seconds = timed(lambda: [app.parse_text_statblock(t) for t in texts])
+    return len(texts), seconds, digest(parsed)
+
+
+def bench_load_json(corpus):
+    texts = [json.dumps(s) for s in sample(corpus)]
+    loaded, seconds = timed(lambda: [app.load_statblock(t) for t in texts], repeat=3)
+    return len(texts), seconds, digest(loaded)
+
+
+def bench_index(corpus):
+    def build():
+        snap = Snapshot.from_records(corpus, 1, app.COMPACT_RECORDS)
+        snap.search_index()
+        return snap
+    snap, seconds = timed(build)
+    return 1, seconds, digest(len(snap)), snap
+
+
+def bench_search(snap):
+    def run():
+        return [[s['name'] for s in snap.search(q.get('category', ''), q.get('tier'),
+                                                q.get('type', ''), q.get('text', ''))[0]]
+                for q in SEARCH_QUERIES]
+    names, seconds = timed(run, repeat=3)
+    return len(SEARCH_QUERIES), seconds, digest(names)
+
+
+def bench_lookup(snap, corpus):
+    names = [s['name'].upper() for s in sample(corpus)]
+    found, seconds = timed(lambda: [app.find_stat(snap, n)['name'] for n in names], repeat=3)
+    return len(names), seconds, digest(found)
+
+
+def bench_retier(corpus):
+    cards = [s for s in sample(corpus) if s.get('category') == 'Adversaries']
+
+    def run():
+        results = []
+        for s in cards:
+            for tier in app.TIERS:
+                try:
+                    results.append(app.retier(copy.deepcopy(s), tier))
+                except (KeyError, TypeError, ValueError):
+                    results.append('error')
+        return results
+    results, seconds = timed(run)
+    return len(cards) * len(app.TIERS), seconds, digest(results)
+
+
+def bench_api_search(corpus):
+    """Times /api/search through the Flask test client, serialization included."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'statblocks.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(corpus, f)
+        saved_store, app.store = app.store, StatblockStore(path, compact_records=app.COMPACT_RECORDS)
+        try:
+            client = app.app.test_client()
+            client.post('/api/search', json=SEARCH_QUERIES[0])
+
+            def run():
+                return [[r['name'] for r in client.post('/api/search', json=q).get_json()['results']]
+                        for q in SEARCH_QUERIES]
+            names, seconds = timed(run, repeat=3)
+        finally:
+            app.store = saved_store
+    return len(SEARCH_QUERIES), seconds, digest(names)
+
+
+def bench_store(corpus):
+    """Times a cold load, SAVES journaled saves and a compaction of the data file."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'statblocks.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(corpus, f, indent=2)
+
+        store = StatblockStore(path, compact_after=10 ** 9, compact_records=app.COMPACT_RECORDS)
+        snap, seconds = timed(store.snapshot)
+        results['load'] = (1, seconds, digest(len(snap)))
+
+        cards = sample(corpus)[:SAVES]
+
+        def save():
+            for s in cards:
+                store.upsert(s['name'], dict(s, description='Saved by the benchmark'))
+        _, seconds = timed(save)
+        results['save'] = (len(cards), seconds, digest([s['name'] for s in store.snapshot()][-SAVES:]))
+
+        _, seconds = timed(store.compact)
+        with open(path, 'r', encoding='utf-8') as f:
+            results['compact'] = (1, seconds, digest(json.load(f)))
+    return results
+
+
+def run_size(records, size, log):
+    corpus = scale_corpus(records, size)
+    results = {}
+
+    def record(op, outcome):
+        count, seconds, result_digest = outcome[:3]
+        results[op] = {'count': count, 'seconds': round(seconds, 6),
+                       'per_op_us': round(seconds / count * 1e6, 3), 'digest': result_digest}
+        log(f"{size:>8} {op:<12} {count:>8} ops {seconds:10.4f}s {results[op]['per_op_us']:12.3f}us/op")
+
+    record('parse', bench_parse(corpus))
+    record('load_json', bench_load_json(corpus))
+    outcome = bench_index(corpus)
+    record('index', outcome)
+    snap = outcome[3]
+    record('search', bench_search(snap))
+    record('lookup', bench_lookup(snap, corpus))
+    record('retier', bench_retier(corpus))
+    record('api_search', bench_api_search(corpus))
+    for op, outcome in bench_store(corpus).items():
+        record(op, outcome)
+    return results
+
+
+def check_golden(report, golden):
+    """Marks each result ok, mismatch or missing against the golden digests."""
+    failures = 0
+    for size, ops in report['results'].items():
+        for op, result in ops.items():
+            expected = golden.get(size, {}).get(op)
+            if expected is None:
+                result['golden'] = 'missing'
+            elif expected == result['digest']:
+                result['golden'] = 'ok'
+            else:
+                result['golden'] = 'mismatch'
+                failures += 1
+    return failures
+
+
+def compare(report, previous, log):
+    log('Compared with the previous run (ratio above 1 is slower now):')
+    for size, ops in report['results'].items():
+        for op, result in ops.items():
+            before = previous.get('results', {}).get(size, {}).get(op)
+            if before and before['seconds']:
+                log(f"{size:>8} {op:<12} {result['seconds'] / before['seconds']:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the codex data layer on scaled catalogs.')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='Comma-separated catalog sizes (default: 10000,100000)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare against')
+    parser.add_argument('--update-golden', action='store_true',
+                        help='Store the digests of this run as the golden results')
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    with open(app.DEFAULT_FILE, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'base_records': len(records),
+        },
+        'results': {},
+    }
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        report['results'][str(size)] = run_size(records, size, log)
+
+    golden = {}
+    if os.path.isfile(GOLDEN_FILE):
+        with open(GOLDEN_FILE, 'r', encoding='utf-8') as f:
+            golden = json.load(f)
+    if args.update_golden:
+        for size, ops in report['results'].items():
+            golden[size] = {op: result['digest'] for op, result in ops.items()}
+        with open(GOLDEN_FILE, 'w', encoding='utf-8') as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+            f.write('\n')
+    failures = check_golden(report, golden)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f), log)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if failures:
+        log(f'{failures} results differ from the golden results')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,382 @@
+"""Load test that replays a mix of API traffic against the codex.
+
+Drives the real routes: /api/search with mixed filters, text and modes,
+/api/stat, /api/retier, the list endpoints and bursts of /api/save, from
+several threads at once. Runs in process through the Flask test client on
+a temporary copy of the data (with the storage backend chosen by
+CODEX_STORAGE), or against a running instance with --url. Reports the
+throughput and the p50/p95/p99 latency of each endpoint.
+
+    python -m benchmarks.loadtest --requests 5000 --concurrency 8 --output before.json
+    python -m benchmarks.loadtest --mix search=60,stat=30,save=10 --compare before.json
+    python -m benchmarks.loadtest --url http://localhost:8282
+
+Saves write cards named "Load Test <n>", so against a running instance
+they add up to --save-names cards to its data; use --mix without save to
+leave it unchanged.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import http.client
+from urllib.parse import quote, urlsplit
+
+import app
+from store import StatblockStore
+
+# Relative weights of the kinds of operation; save is one burst of saves
+DEFAULT_MIX = 'search=40,stat=25,retier=15,list=10,save=10'
+KINDS = ('search', 'stat', 'retier', 'list', 'save')
+SEARCH_PHRASES = ['mark a stress', 'close range', 'spend a fear', 'd8+3', 'hidden', 'flicker']
+SAVE_PREFIX = 'Load Test'
+# Cards fetched to be copied by saves
+SAVE_TEMPLATES = 20
+
+
+def parse_mix(text):
+    """Reads "search=40,stat=25,..." into {kind: weight}; raises ValueError if it is not valid."""
+    mix = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f'unknown operation {kind!r}, expected one of {", ".join(KINDS)}')
+        mix[kind] = float(weight)
+        if mix[kind] < 0:
+            raise ValueError(f'the weight of {kind} must not be negative')
+    if not sum(mix.values()):
+        raise ValueError('the mix must give some operation a weight')
+    return mix
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    rank = max(math.ceil(fraction * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class TestClient:
+    """Sends requests through the Flask test client."""
+
+    def __init__(self):
+        self.client = app.app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        data = response.get_data()
+        return response.status_code, data
+
+    def close(self):
+        pass
+
+
+class HttpClient:
+    """Sends requests to a running instance over one kept-alive connection."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        connection = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connect = lambda: connection(parts.netloc, timeout=60)
+        self.base = parts.path.rstrip('/')
+        self.connection = self.connect()
+
+    def request(self, method, path, body=None):
+        headers = {}
+        encoded = None
+        if body is not None:
+            encoded = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, self.base + path, body=encoded, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed the kept-alive connection; retry once on a new one
+            self.connection.close()
+            self.connection = self.connect()
+            self.connection.request(method, self.base + path, body=encoded, headers=headers)
+            response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        self.connection.close()
+
+
+def fetch_json(client, method, path, body=None):
+    status, data = client.request(method, path, body)
+    if status != 200:
+        raise RuntimeError(f'{method} {path} returned {status}')
+    return json.loads(data)
+
+
+def load_cards(client):
+    """Returns the adversaries and environments of the target, and some full cards to save."""
+    adversaries = [c for c in fetch_json(client, 'GET', '/api/adversaries')
+                   if not c['name'].startswith(SAVE_PREFIX)]
+    environments = fetch_json(client, 'GET', '/api/environments')
+    if not adversaries:
+        raise RuntimeError('the target has no adversaries to load test with')
+    step = max(len(adversaries) // SAVE_TEMPLATES, 1)
+    templates = [fetch_json(client, 'GET', stat_path(c['name'])) for c in adversaries[::step][:SAVE_TEMPLATES]]
+    return adversaries, environments, templates
+
+
+def stat_path(name):
+    return '/api/stat/' + quote(name, safe='')
+
+
+def save_payload(card, name):
+    """Returns the /api/save form fields for a copy of card under a new name."""
+    payload = dict(card, name=name)
+    for field in ('motives_tactics', 'experience', 'impulses'):
+        if isinstance(payload.get(field), list):
+            payload[field] = ', '.join(payload[field])
+    return payload
+
+
+class Traffic:
+    """Makes the operations of a load test, each a list of (endpoint, method, path, body)."""
+
+    def __init__(self, adversaries, environments, templates, mix, burst, save_names, seed):
+        self.adversaries = adversaries
+        self.cards = adversaries + environments
+        self.templates = templates
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.burst = burst
+        self.save_names = save_names
+        self.words = sorted({w for c in self.cards for w in c['name'].lower().split() if len(w) > 2})
+        self.types = sorted({c.get('type') for c in self.cards if c.get('type')})
+        self.rng = random.Random(seed)
+
+    def operations(self, count):
+        return [self.operation() for _ in range(count)]
+
+    def operation(self):
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        return getattr(self, kind)()
+
+    def search(self):
+        rng = self.rng
+        body = {}
+        if rng.random() < 0.7:
+            body['text'] = rng.choice(self.words) if rng.random() < 0.6 else rng.choice(SEARCH_PHRASES)
+        if rng.random() < 0.5:
+            body['category'] = rng.choice(['Adversaries', 'Environments'])
+        if rng.random() < 0.4:
+            body['tier'] = rng.choice(app.TIERS)
+        if rng.random() < 0.3:
+            body['type'] = rng.choice(self.types)
+        if body.get('text') and rng.random() < 0.3:
+            body['mode'] = 'ranked'
+        if rng.random() < 0.5:
+            body['limit'] = rng.choice([10, 20, 50])
+        return [('POST /api/search', 'POST', '/api/search', body)]
+
+    def stat(self):
+        return [('GET /api/stat', 'GET', stat_path(self.rng.choice(self.cards)['name']), None)]
+
+    def retier(self):
+        body = {'name': self.rng.choice(self.adversaries)['name'], 'new_tier': self.rng.choice(app.TIERS)}
+        return [('POST /api/retier', 'POST', '/api/retier', body)]
+
+    def list(self):
+        path = self.rng.choice(['/api/adversaries', '/api/environments',
+                                '/api/adversaries?limit=20&offset=20', '/api/types?category=Adversaries'])
+        return [('GET ' + path.split('?')[0], 'GET', path, None)]
+
+    def save(self):
+        return [('POST /api/save', 'POST', '/api/save',
+                 save_payload(self.rng.choice(self.templates),
+                              f'{SAVE_PREFIX} {self.rng.randrange(self.save_names)}'))
+                for _ in range(self.burst)]
+
+
+def run(make_client, operations, concurrency):
+    """Runs the operations on concurrency threads; returns the timings and the seconds taken."""
+    pending = iter(operations)
+    lock = threading.Lock()
+    timings = []
+
+    def worker():
+        client = make_client()
+        results = []
+        try:
+            while True:
+                with lock:
+                    operation = next(pending, None)
+                if operation is None:
+                    break
+                for endpoint, method, path, body in operation:
+                    start = time.perf_counter()
+                    try:
+                        status, _ = client.request(method, path, body)
+                    except (http.client.HTTPException, OSError):
+                        status = 0
+                    results.append((endpoint, time.perf_counter() - start, status))
+        finally:
+            client.close()
+            with lock:
+                timings.extend(results)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, time.perf_counter() - start
+
+
+def summarize(timings, seconds):
+    """Returns the request count, errors, throughput and latency percentiles per endpoint."""
+    by_endpoint = {}
+    for endpoint, elapsed, status in timings:
+        by_endpoint.setdefault(endpoint, []).append((elapsed, status))
+    by_endpoint['all'] = [(elapsed, status) for _, elapsed, status in timings]
+
+    results = {}
+    for endpoint, samples in sorted(by_endpoint.items()):
+        latencies = sorted(elapsed for elapsed, _ in samples)
+        statuses = {}
+        for _, status in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        results[endpoint] = {
+            'requests': len(samples),
+            # Server errors and failed connections; 4xx answers are counted in statuses
+            'errors': sum(1 for _, status in samples if status >= 500 or status == 0),
+            'statuses': statuses,
+            'throughput': round(len(samples) / seconds, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+        }
+    return results
+
+
+def report_table(results, log):
+    log(f"{'endpoint':<24} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, r in results.items():
+        log(f"{endpoint:<24} {r['requests']:>8} {r['errors']:>6} {r['throughput']:>9.1f} "
+            f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+def compare(report, previous, log):
+    log('Compared with the previous run (ratio above 1 is slower now):')
+    log(f"{'endpoint':<24} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7}")
+    for endpoint, result in report['results'].items():
+        before = previous.get('results', {}).get(endpoint)
+        if not before:
+            continue
+        ratios = [before['throughput'] / result['throughput'] if result['throughput'] else 0]
+        ratios += [result[k] / before[k] if before[k] else 0 for k in ('p50_ms', 'p95_ms', 'p99_ms')]
+        log(f"{endpoint:<24} " + ' '.join(f'{r:6.2f}x' for r in ratios))
+
+
+def in_process_target(tmp, data_file):
+    """Points app at a copy of data_file in tmp, with the configured storage backend."""
+    if app.STORAGE == 'sqlite':
+        from sqlite_store import SqliteStore
+        return SqliteStore(os.path.join(tmp, 'statblocks.db'), data_file)
+    path = os.path.join(tmp, 'statblocks.json')
+    shutil.copyfile(data_file, path)
+    return StatblockStore(path, compact_records=app.COMPACT_RECORDS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a mix of API traffic and report latencies.')
+    parser.add_argument('--url', help='Base URL of a running instance (default: the Flask test client)')
+    parser.add_argument('--data', default=app.DEFAULT_FILE,
+                        help='Statblock file copied for the in-process run (default: the default cards)')
+    parser.add_argument('--requests', type=int, default=2000, help='Operations to run (default: 2000)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Threads sending requests (default: 4)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Weights of the operations (default: {DEFAULT_MIX})')
+    parser.add_argument('--burst', type=int, default=5, help='Saves in each save operation (default: 5)')
+    parser.add_argument('--save-names', type=int, default=50,
+                        help='Distinct "Load Test <n>" cards written by saves (default: 50)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generated traffic (default: 1)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='Results file of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(f'--mix: {e}')
+    if args.requests < 1 or args.concurrency < 1 or args.burst < 1 or args.save_names < 1:
+        parser.error('--requests, --concurrency, --burst and --save-names must be at least 1')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saved_store = app.store
+        if args.url:
+            make_client = lambda: HttpClient(args.url)
+        else:
+            app.store = in_process_target(tmp, args.data)
+            make_client = TestClient
+        try:
+            setup = make_client()
+            try:
+                traffic = Traffic(*load_cards(setup), mix, args.burst, args.save_names, args.seed)
+            finally:
+                setup.close()
+            operations = traffic.operations(args.requests)
+            log(f"Running {args.requests} operations on {args.concurrency} threads against "
+                f"{args.url or 'the Flask test client (' + app.STORAGE + ' storage)'}")
+            timings, seconds = run(make_client, operations, args.concurrency)
+        finally:
+            app.store = saved_store
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'target': args.url or 'test_client',
+            'storage': None if args.url else app.STORAGE,
+            'compact_records': None if args.url else app.COMPACT_RECORDS,
+            'operations': args.requests,
+            'concurrency': args.concurrency,
+            'mix': mix,
+            'burst': args.burst,
+            'seed': args.seed,
+            'seconds': round(seconds, 3),
+        },
+        'results': summarize(timings, seconds),
+    }
+    report_table(report['results'], log)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f), log)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    errors = report['results']['all']['errors']
+    if errors:
+        log(f'{errors} requests failed')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Memory benchmark of compact records against plain dict statblocks.
+
+Loads scaled catalogs from JSON text, as the store does from the data
+file, and measures the memory held by the records and by a store snapshot
+of them, once as dicts and once as records.Record objects. Also checks
+that every compact record converts back to the same JSON.
+
+    python -m benchmarks.memory --sizes 10000,100000
+"""
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+import app
+from records import record_hook, thaw
+from store import Snapshot
+from benchmarks.bench import scale_corpus
+
+
+def measure(build):
+    """Returns what build() returns, the bytes it still holds and the seconds it took."""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = build()
+        seconds = time.perf_counter() - start
+        held, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, held, seconds
+
+
+def run_size(records, size, log):
+    # Fresh objects from JSON text, as read from the data file, so copies share no strings
+    text = json.dumps(scale_corpus(records, size))
+    results = {}
+
+    def record(name, held, seconds):
+        results[name] = {'bytes': held, 'bytes_per_record': round(held / size, 1),
+                         'seconds': round(seconds, 6)}
+        log(f"{size:>8} {name:<16} {held / 2 ** 20:10.1f} MiB {held / size:10.1f} B/record "
+            f"{seconds:8.3f}s")
+
+    plain, held, seconds = measure(lambda: json.loads(text))
+    record('dict_records', held, seconds)
+    compact, held, seconds = measure(lambda: json.loads(text, object_hook=record_hook))
+    record('compact_records', held, seconds)
+    if [thaw(s) for s in compact] != plain:
+        raise AssertionError('compact records do not convert back to the same statblocks')
+    del plain, compact
+
+    _, held, seconds = measure(lambda: Snapshot.from_records(json.loads(text), 1))
+    record('dict_snapshot', held, seconds)
+    _, held, seconds = measure(lambda: Snapshot.from_records(
+        json.loads(text, object_hook=record_hook), 1, compact=True))
+    record('compact_snapshot', held, seconds)
+
+    saved = 1 - results['compact_snapshot']['bytes'] / results['dict_snapshot']['bytes']
+    log(f"{size:>8} compact snapshots use {saved:.0%} less memory")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the memory used by dict and compact statblocks.')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='Comma-separated catalog sizes (default: 10000,100000)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    with open(app.DEFAULT_FILE, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    report = {str(size): run_size(records, size, log)
+              for size in [int(s) for s in args.sizes.split(',') if s.strip()]}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
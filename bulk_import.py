@@ -0,0 +1,156 @@
+import re
+import sys
+import json
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+# A line starting a text statblock's tier line; the line before it is a name
+TIER_LINE_RE = re.compile(r'^Tier \d+', re.IGNORECASE)
+# An explicit separator between text statblocks
+SEPARATOR_RE = re.compile(r'^-{3,}$')
+
+
+class CardError(Exception):
+    """A card that could not be read from the import file."""
+
+
+def split_text_statblocks(lines):
+    """Splits the lines of a multi-card text file into one text per card.
+
+    A card starts at the name line before each "Tier N" line, or after a
+    "---" separator line.
+    """
+    card = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if SEPARATOR_RE.match(line):
+            if card:
+                yield '\n'.join(card)
+            card = []
+            continue
+        if TIER_LINE_RE.match(line) and len(card) > 1:
+            name = card.pop()
+            yield '\n'.join(card)
+            card = [name]
+        card.append(line)
+    if card:
+        yield '\n'.join(card)
+
+
+def iter_cards(lines):
+    """Yields the cards in an import file, given an iterator over its lines.
+
+    Reads a JSON array, NDJSON with one JSON statblock per line, or
+    statblocks in the text format. JSON cards are yielded as dicts and text
+    cards as strings; a card that cannot be read is yielded as a CardError.
+    """
+    lines = iter(lines)
+    first = ''
+    for first in lines:
+        if first.strip():
+            break
+    first = first.strip()
+
+    if first.startswith('['):
+        cards = json.loads(first + ''.join(lines))
+        if not isinstance(cards, list):
+            raise ValueError('Expected a JSON list of statblocks')
+        yield from cards
+    elif first.startswith('{'):
+        try:
+            yield json.loads(first)
+        except ValueError:
+            # A single statblock spread over several lines
+            yield json.loads(first + ''.join(lines))
+            return
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield CardError(f'Invalid JSON: {e}')
+    elif first:
+        yield from split_text_statblocks(itertools.chain([first], lines))
+
+
+def import_cards(cards, parse, workers=0, chunksize=64):
+    """Parses cards, yielding (index, statblock, error) for each of them.
+
+    parse turns one card from iter_cards() into a statblock. With workers
+    set, cards are parsed by a pool of that many processes, in which case
+    parse must be importable by name.
+    """
+    cards = iter(cards)
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_parse_one, ((parse, card) for card in cards), chunksize=chunksize)
+            yield from ((i,) + result for i, result in enumerate(results))
+    else:
+        for i, card in enumerate(cards):
+            yield (i,) + _parse_one((parse, card))
+
+
+def _parse_one(job):
+    parse, card = job
+    if isinstance(card, CardError):
+        return None, str(card)
+    try:
+        stat = parse(card)
+    except Exception as e:
+        return None, f'Could not parse statblock: {e}'
+    if not isinstance(stat, dict) or not stat.get('name'):
+        return None, 'Name is required'
+    if not isinstance(stat['name'], str):
+        return None, 'Name must be a string'
+    if not stat['name'].strip():
+        return None, 'Name is required'
+    stat['name'] = stat['name'].strip()
+    return stat, None
+
+
+def run_import(cards, parse, save, workers=0):
+    """Parses every card and saves the valid ones with one call to save.
+
+    Returns a summary with the imported names and the per-card errors.
+    """
+    items = []
+    errors = []
+    for index, stat, error in import_cards(cards, parse, workers):
+        if error:
+            errors.append({'index': index, 'error': error})
+        else:
+            items.append((stat['name'], stat))
+    if save and items:
+        save(items)
+    return {'imported': [name for name, _ in items], 'errors': errors}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import many statblocks from a text, JSON or NDJSON file.')
+    parser.add_argument('file', help='File of statblocks to import')
+    parser.add_argument('--workers', type=int, default=0, help='Parse with this many processes')
+    parser.add_argument('--dry-run', action='store_true', help='Parse and report without saving')
+    args = parser.parse_args(argv)
+
+    import app
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        try:
+            cards = iter_cards(f)
+            summary = run_import(cards, app.parse_card,
+                                 None if args.dry_run else app.store.upsert_many, args.workers)
+        except ValueError as e:
+            parser.error(f'{args.file}: {e}')
+
+    for error in summary['errors']:
+        print(f"Card {error['index'] + 1}: {error['error']}", file=sys.stderr)
+    action = 'Parsed' if args.dry_run else 'Imported'
+    print(f"{action} {len(summary['imported'])} statblocks, {len(summary['errors'])} errors")
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
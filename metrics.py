@@ -0,0 +1,131 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Counts of observed durations per bucket, plus their sum."""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self, size):
+        # One count per bucket, the last one for anything above every bound
+        self.counts = [0] * (size + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, buckets, seconds):
+        self.counts[bisect.bisect_left(buckets, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+class Metrics:
+    """Per-endpoint request timings and per-phase span timings.
+
+    start_request() and end_request() bracket a request on the current
+    thread; span() times a phase of the work (loading the data, filtering,
+    serializing, saving) inside it. Spans outside a request are not
+    recorded, so the instrumented functions can also be called from scripts.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # (endpoint, method, status) -> count
+        self.requests = {}
+        # (endpoint, method) -> Histogram
+        self.durations = {}
+        # (endpoint, phase) -> Histogram
+        self.phases = {}
+
+    def start_request(self):
+        self._local.request = (time.perf_counter(), [])
+
+    @contextmanager
+    def span(self, phase):
+        """Times the enclosed block as phase of the current request."""
+        current = getattr(self._local, 'request', None)
+        if current is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            current[1].append((phase, time.perf_counter() - start))
+
+    def end_request(self, endpoint, method, status):
+        """Records the current request.
+
+        Returns its duration in seconds and the total time per phase, or
+        None if no request was started on this thread.
+        """
+        current = getattr(self._local, 'request', None)
+        if current is None:
+            return None
+        self._local.request = None
+        elapsed = time.perf_counter() - current[0]
+        phases = {}
+        for phase, seconds in current[1]:
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._histogram(self.durations, (endpoint, method)).observe(self.buckets, elapsed)
+            for phase, seconds in phases.items():
+                self._histogram(self.phases, (endpoint, phase)).observe(self.buckets, seconds)
+        return elapsed, phases
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(len(self.buckets))
+        return histogram
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = [
+            '# HELP codex_requests_total Requests handled, by endpoint, method and status.',
+            '# TYPE codex_requests_total counter',
+        ]
+        with self._lock:
+            for (endpoint, method, status), n in sorted(self.requests.items()):
+                lines.append(f'codex_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {n}')
+            lines += [
+                '# HELP codex_request_duration_seconds Time spent handling requests.',
+                '# TYPE codex_request_duration_seconds histogram',
+            ]
+            for (endpoint, method), histogram in sorted(self.durations.items()):
+                self._render_histogram(lines, 'codex_request_duration_seconds', histogram,
+                                       endpoint=endpoint, method=method)
+            lines += [
+                '# HELP codex_phase_duration_seconds Time spent per phase of a request.',
+                '# TYPE codex_phase_duration_seconds histogram',
+            ]
+            for (endpoint, phase), histogram in sorted(self.phases.items()):
+                self._render_histogram(lines, 'codex_phase_duration_seconds', histogram,
+                                       endpoint=endpoint, phase=phase)
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, lines, name, histogram, **labels):
+        cumulative = 0
+        for bound, n in zip(self.buckets + ('+Inf',), histogram.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{_labels(**labels, le=bound)}}} {cumulative}')
+        lines.append(f'{name}_sum{{{_labels(**labels)}}} {histogram.total:.6f}')
+        lines.append(f'{name}_count{{{_labels(**labels)}}} {histogram.count}')
@@ -0,0 +1,142 @@
+"""Compact, read-only statblock records for large catalogs.
+
+A statblock read from JSON is a dict per card and per feature, with its own
+copy of every string. freeze() turns it into Records instead: the values
+are kept in a tuple, the field names once per distinct field layout, and
+values that repeat across the catalog (category, type, range, damage type
+and the like) once per process. Records behave as read-only mappings, so
+s.get('name'), s['features'] and dict(s) work as before; they turn back
+into the plain JSON shape when serialized or copied for modification.
+"""
+import sys
+from collections.abc import Mapping
+
+# Fields whose string values repeat across cards, so each value is kept once
+INTERNED_FIELDS = frozenset(['category', 'type', 'tier', 'range', 'damage_type', 'weapon', 'atk',
+                             'thresholds', 'damage_dice'])
+
+
+class Layout:
+    """The field names of a group of records, in order, with their positions."""
+
+    __slots__ = ('keys', 'index', 'interned')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = {key: i for i, key in enumerate(keys)}
+        # Positions of the values to intern
+        self.interned = tuple(i for i, key in enumerate(keys) if key in INTERNED_FIELDS)
+
+    def __reduce__(self):
+        return (layout, (self.keys,))
+
+
+_layouts = {}
+
+
+def layout(keys):
+    """Returns the shared Layout for a tuple of field names."""
+    found = _layouts.get(keys)
+    if found is None:
+        found = _layouts.setdefault(keys, Layout(tuple(sys.intern(k) for k in keys)))
+    return found
+
+
+class Record(Mapping):
+    """A read-only statblock, or feature of one, made by freeze()."""
+
+    __slots__ = ('_layout', '_values')
+
+    def __init__(self, layout, values):
+        self._layout = layout
+        self._values = values
+
+    def __getitem__(self, key):
+        i = self._layout.index.get(key)
+        if i is None:
+            raise KeyError(key)
+        return self._values[i]
+
+    def get(self, key, default=None):
+        i = self._layout.index.get(key)
+        return default if i is None else self._values[i]
+
+    def __contains__(self, key):
+        return key in self._layout.index
+
+    def __iter__(self):
+        return iter(self._layout.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Record) and other._layout is self._layout:
+            return self._values == other._values
+        if isinstance(other, Mapping):
+            return thaw(self) == thaw(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Record({thaw(self)!r})'
+
+    def __reduce__(self):
+        return (Record, (self._layout, self._values))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        # A deep copy is made to be modified, so it is a plain dict
+        return thaw(self)
+
+
+def _record(keys, values):
+    found = layout(keys)
+    for i in found.interned:
+        if type(values[i]) is str:
+            values[i] = sys.intern(values[i])
+    return Record(found, tuple(values))
+
+
+def freeze(value):
+    """Returns value with every dict in it turned into a Record.
+
+    Lists stay lists, so str() of a field and comparisons with plain
+    statblocks are unchanged.
+    """
+    if isinstance(value, dict):
+        values = [freeze(item) if type(item) in (dict, list) else item for item in value.values()]
+        return _record(tuple(value), values)
+    if isinstance(value, list):
+        return [freeze(item) if type(item) in (dict, list) else item for item in value]
+    return value
+
+
+def record_hook(obj):
+    """An object_hook for json.load() and json.loads() that reads objects as Records.
+
+    The decoder hands over the innermost objects first, so their values
+    are already frozen.
+    """
+    return _record(tuple(obj), list(obj.values()))
+
+
+def thaw(value):
+    """Returns a plain, modifiable copy of value in the JSON shape."""
+    if isinstance(value, Record):
+        return {key: thaw(item) for key, item in zip(value._layout.keys, value._values)}
+    if isinstance(value, list):
+        return [thaw(item) for item in value]
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    return value
+
+
+def to_json(value):
+    """A default= hook for json.dump() and json.dumps() that writes Records as objects."""
+    if isinstance(value, Record):
+        return dict(zip(value._layout.keys, value._values))
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
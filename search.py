@@ -0,0 +1,746 @@
+import re
+import sys
+import math
+import heapq
+import bisect
+import itertools
+from collections.abc import Mapping
+
+TOKEN_RE = re.compile(r'\w+')
+# Entries kept by the memos of the search indexes before they start over
+MEMO_SIZE = 4096
+# Items added to a sorted list before they are merged into it; see sorted_add()
+RECENT_SIZE = 512
+
+
+def build_haystack(s):
+    """Builds the lowercase string that /api/search matches text against."""
+    haystack_fields = ['name', 'description', 'type']
+    hay = ' '.join([str(s.get(field, '')) for field in haystack_fields]).lower()
+
+    if s.get('category') == 'Adversaries':
+        adversary_fields = ['motives_tactics']
+        hay += ' ' + ' '.join([str(s.get(field, '')) for field in adversary_fields]).lower()
+        weapon_fields = ['weapon', 'damage_type']
+        hay += ' ' + ' '.join([str(s.get(field, '')) for field in weapon_fields]).lower()
+    elif s.get('category') == 'Environments':
+        environment_fields = ['impulses', 'potential_adversaries']
+        hay += ' ' + ' '.join([str(s.get(field, '')) for field in environment_fields]).lower()
+
+    # Include features in search
+    for f in s.get('features', []):
+        hay += f" {str(f.get('name','')).lower()} {str(f.get('description','')).lower()}"
+    return hay
+
+
+def prefixed(items, prefix):
+    """Yields the items of a sorted list of strings that start with prefix."""
+    for i in range(bisect.bisect_left(items, prefix), len(items)):
+        if not items[i].startswith(prefix):
+            break
+        yield items[i]
+
+
+def sorted_add(parts, item):
+    """Returns a (base, recent) pair of sorted lists with item added.
+
+    Only the short recent list is copied, and it is merged into the base
+    once it grows past RECENT_SIZE, so readers holding the old pair are
+    never disturbed and adding costs little however long the base is.
+    """
+    base, recent = parts
+    recent = list(recent)
+    bisect.insort(recent, item)
+    if len(recent) > RECENT_SIZE:
+        return list(heapq.merge(base, recent)), []
+    return base, recent
+
+
+def sorted_prefixed(parts, prefix):
+    """Yields the items of a (base, recent) pair that start with prefix, in order."""
+    return heapq.merge(*[prefixed(items, prefix) for items in parts])
+
+
+def query_terms(text):
+    """Splits lowercase search text into (token, open_left, open_right) terms.
+
+    A term is open on a side when it touches that end of the text, because
+    the matched substring may continue into the surrounding word there.
+    """
+    terms = []
+    for m in TOKEN_RE.finditer(text):
+        terms.append((m.group(0), m.start() == 0, m.end() == len(text)))
+    return terms
+
+
+def trigrams(word):
+    """Returns the three-letter sequences of word, padded with a space at each end."""
+    padded = f' {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Death clock of a record that has not been replaced
+LIVE = sys.maxsize
+
+
+class Visibility:
+    """Which slots of a catalog one snapshot sees.
+
+    A catalog keeps every record any of its snapshots holds in a numbered
+    slot, only ever appending new ones. A save marks the slots it replaces
+    as dead from its clock on, in died. A snapshot sees the slots made
+    before its limit that were still alive at its clock.
+    """
+
+    __slots__ = ('limit', 'clock', 'died')
+
+    def __init__(self, limit, clock, died):
+        self.limit = limit
+        self.clock = clock
+        self.died = died
+
+    def __call__(self, slot):
+        return slot < self.limit and self.died[slot] > self.clock
+
+    def filter(self, slots):
+        """Yields the visible slots among slots, in the same order."""
+        slots, check = itertools.tee(filter(self.limit.__gt__, slots))
+        return itertools.compress(slots, map(self.clock.__lt__, map(self.died.__getitem__, check)))
+
+    def ascending(self, slots):
+        """Like filter(), for slots in ascending order: stops at the limit."""
+        slots, check = itertools.tee(itertools.takewhile(self.limit.__gt__, slots))
+        return itertools.compress(slots, map(self.clock.__lt__, map(self.died.__getitem__, check)))
+
+
+
+
+class SearchIndex:
+    """Precomputed haystacks and an inverted token index for a catalog.
+
+    Text searches look up the records containing every query token first
+    and only run the substring check on those candidates, so the cost
+    follows the number of matches instead of the size of the catalog.
+    The index is shared by every snapshot of a catalog: saves only append
+    a haystack and add its slot to the end of its tokens' postings, and
+    each search skips the slots its snapshot does not see.
+    """
+
+    __slots__ = ('haystacks', 'postings', 'vocab', 'grams', '_partial')
+
+    def __init__(self):
+        # slot -> haystack
+        self.haystacks = []
+        # token -> slots of the records containing it, ascending
+        self.postings = {}
+        # Sorted tokens, for prefix lookups; see sorted_add()
+        self.vocab = ([], [])
+        # trigram -> tokens containing it, see trigrams()
+        self.grams = {}
+        # Tokens matching partial tokens, memoized per index
+        self._partial = {}
+
+    @classmethod
+    def build(cls, stats):
+        index = cls()
+        for slot, stat in enumerate(stats):
+            hay = build_haystack(stat)
+            index._add(slot, hay)
+            index.haystacks.append(hay)
+        index.vocab = (sorted(index.postings), [])
+        return index
+
+    def update(self, clock, removed, slot, stat):
+        """Indexes the record saved at clock in a new slot.
+
+        The records it replaces stay, for the snapshots that still see them.
+        """
+        hay = build_haystack(stat)
+        for token in self._add(slot, hay):
+            self.vocab = sorted_add(self.vocab, token)
+        # Last, so every slot below len(haystacks) is in the postings
+        self.haystacks.append(hay)
+
+    def _add(self, slot, hay):
+        """Adds slot to the postings of the tokens of hay; returns the tokens new to the index."""
+        postings = self.postings
+        new = []
+        for token in set(TOKEN_RE.findall(hay)):
+            slots = postings.get(token)
+            if slots is None:
+                postings[token] = [slot]
+                new.append(token)
+                for gram in trigrams(token):
+                    self.grams.setdefault(gram, []).append(token)
+            else:
+                slots.append(slot)
+        return new
+
+    def _tokens(self, token, open_left, open_right):
+        """Returns the indexed tokens that token starts, ends or is part of, as its open sides allow.
+
+        Returns None when token is too short to look up that way.
+        """
+        if not open_left:
+            return list(sorted_prefixed(self.vocab, token))
+        # Tokens ending with token have every trigram of it followed by a space
+        part = token if open_right else token + ' '
+        tokens = min((self.grams.get(part[i:i + 3], ()) for i in range(len(part) - 2)),
+                     key=len, default=None)
+        if tokens is None:
+            return None
+        if open_right:
+            return [word for word in tokens if token in word]
+        return [word for word in tokens if word.endswith(token)]
+
+    def _term_keys(self, token, open_left, open_right, limit):
+        if not open_left and not open_right:
+            return self.postings.get(token, ())
+
+        memo_key = (token, open_left, open_right)
+        found = self._partial.get(memo_key)
+        # A lookup made with more slots indexed is still good for this one
+        if found is not None and found[0] >= limit:
+            return found[1]
+        indexed = len(self.haystacks)
+        tokens = self._tokens(token, open_left, open_right)
+        if tokens is None:
+            # Found in most records anyway, so narrows nothing down
+            return None
+        keys = set()
+        postings = self.postings
+        for word in tokens:
+            keys.update(postings[word])
+        if len(self._partial) >= MEMO_SIZE:
+            self._partial = {}
+        self._partial[memo_key] = (indexed, keys)
+        return keys
+
+    def candidates(self, text, limit):
+        """Returns the slots of records whose haystack may contain text.
+
+        May include slots a snapshot with the given limit does not see.
+        Returns None when the text has no word characters to look up, or
+        only partial ones too short to, in which case every record is a
+        candidate.
+        """
+        terms = query_terms(text)
+        if not terms:
+            return None
+        # Look up exact terms first, they usually give the smallest sets.
+        terms.sort(key=lambda t: t[1] or t[2])
+        result = None
+        for token, open_left, open_right in terms:
+            keys = self._term_keys(token, open_left, open_right, limit)
+            if keys is None:
+                continue
+            result = set(keys) if result is None else result.intersection(keys)
+            if not result:
+                break
+        return result
+
+    def search(self, text, visible):
+        """Returns the slots of the visible records whose haystack contains text, unordered."""
+        keys = self.candidates(text, visible.limit)
+        if keys is None:
+            keys = range(visible.limit)
+        haystacks = self.haystacks
+        return [slot for slot in visible.filter(keys) if text in haystacks[slot]]
+
+
+def tier_value(s):
+    """Returns the tier of a statblock as an int, or None if it has none."""
+    try:
+        return int(s.get('tier'))
+    except Exception:
+        return None
+
+
+def _facet_value(value):
+    # Search filters are strings, so any other value can never match one.
+    return value if isinstance(value, str) else None
+
+
+def facet_of(s):
+    """Returns the (category, tier, type) bucket a statblock belongs to."""
+    return (_facet_value(s.get('category')), tier_value(s), _facet_value(s.get('type')))
+
+
+class FacetIndex:
+    """Records partitioned into buckets by (category, tier, type).
+
+    The index is shared by every snapshot of a catalog (see Visibility):
+    each bucket lists the slots of its records in file order, and saves
+    only ever append to it. Filter-only searches merge the matching
+    buckets, skipping the slots a snapshot does not see, instead of
+    checking every record.
+    """
+
+    __slots__ = ('buckets', 'facets')
+
+    def __init__(self, buckets, facets):
+        # facet -> slots in that bucket, ascending
+        self.buckets = buckets
+        # slot -> facet
+        self.facets = facets
+
+    @classmethod
+    def build(cls, stats):
+        index = cls({}, [])
+        for slot, stat in enumerate(stats):
+            index.add(slot, stat)
+        return index
+
+    def add(self, slot, stat):
+        """Adds the record in a new slot and returns its facet."""
+        facet = facet_of(stat)
+        self.facets.append(facet)
+        slots = self.buckets.get(facet)
+        if slots is None:
+            self.buckets[facet] = [slot]
+        else:
+            slots.append(slot)
+        return facet
+
+    def matches(self, facet, category, tier, type_):
+        """Checks a bucket against the search filters; tier must already be an int."""
+        return ((not category or facet[0] == category)
+                and (tier is None or facet[1] == tier)
+                and (not type_ or facet[2] == type_))
+
+    def select(self, category, tier, type_, visible, sizes, offset=0, end=None):
+        """Returns a page of the visible slots matching the filters, in file order.
+
+        sizes holds the number of visible records per facet, which gives
+        the total number of matches, returned with the page.
+        """
+        # Copied in one step, as saves may add buckets meanwhile
+        selected = [(facet, slots) for facet, slots in list(self.buckets.items())
+                    if self.matches(facet, category, tier, type_)]
+        total = sum(sizes.get(facet, 0) for facet, _ in selected)
+        if len(selected) == 1:
+            merged = iter(selected[0][1])
+        else:
+            merged = heapq.merge(*[slots for _, slots in selected])
+        return list(itertools.islice(visible.ascending(merged), offset, end)), total
+
+    def sizes(self, slots):
+        """Returns the number of the given slots in each facet."""
+        facets = self.facets
+        totals = {}
+        for slot in slots:
+            facet = facets[slot]
+            totals[facet] = totals.get(facet, 0) + 1
+        return totals
+
+    def counts(self, sizes):
+        """Counts records per category, tier and type from the sizes of their facets."""
+        counts = {'category': {}, 'tier': {}, 'type': {}}
+        for (category, tier, type_), n in sizes.items():
+            for field, value in (('category', category), ('tier', tier), ('type', type_)):
+                if value is None or value == '':
+                    continue
+                value = str(value)
+                counts[field][value] = counts[field].get(value, 0) + n
+        return counts
+
+
+# Field weights for ranked search: a match in the name counts most
+NAME_WEIGHT = 3.0
+FEATURE_WEIGHT = 2.0
+TEXT_WEIGHT = 1.0
+# Query words shorter than these are not matched as a prefix, or by similarity
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+# Words in more than this share of the records only re-rank what rarer words match
+COMMON_FRACTION = 0.2
+# Query words this long may be two typos away from a fuzzy match, shorter ones one
+TWO_TYPO_LENGTH = 8
+# Vocabulary words tried per query word
+MAX_EXPANSIONS = 8
+
+
+def ranked_fields(s):
+    """Returns the (weight, text) fields of a statblock that ranked search scores."""
+    other = dict(s, name='', features=[])
+    fields = [(NAME_WEIGHT, str(s.get('name') or '')),
+              (TEXT_WEIGHT, build_haystack(other))]
+    for f in s.get('features', []):
+        fields.append((FEATURE_WEIGHT, f"{f.get('name', '')} {f.get('description', '')}"))
+    return fields
+
+
+def word_weights(s):
+    """Returns the highest field weight of every word in a statblock."""
+    weights = {}
+    for weight, text in ranked_fields(s):
+        for word in TOKEN_RE.findall(text.lower()):
+            if weights.get(word, 0) < weight:
+                weights[word] = weight
+    return weights
+
+
+def name_phrase(s):
+    return ' '.join(TOKEN_RE.findall(str(s.get('name') or '').lower()))
+
+
+def edit_distance(a, b, limit):
+    """Returns the Damerau-Levenshtein distance between a and b, or limit + 1 if it is more.
+
+    A typo is a letter missing, added or changed, or two letters swapped
+    (each letter being edited once at most).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Letters both words start or end with need no edits
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+    before = None
+    row = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            distance = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + (x != y))
+            if before is not None and j > 1 and x == b[j - 2] and a[i - 2] == y:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > limit:
+            return limit + 1
+        before, row = row, current
+    return min(row[-1], limit + 1)
+
+
+class RankedIndex:
+    """Word and trigram indexes for ranked, typo-tolerant search.
+
+    Query words are matched against the vocabulary of the catalog, never
+    against each record: exactly, as a prefix, or for misspellings within
+    a typo or two, looking the candidates up by trigram. Each matched word's postings then give the records to
+    score, weighted by the field the word appears in.
+
+    The index is shared by every snapshot of a catalog (see Visibility), so
+    saves only ever add to it. Each word keeps its number of live records
+    as of every clock it changed at, so a snapshot scores with its own
+    document frequencies, and words no record of a snapshot has are left
+    out of its matches.
+    """
+
+    __slots__ = ('weights', 'words', 'names', 'counts', 'vocab', 'grams', '_expansions')
+
+    def __init__(self):
+        # word -> {slot: field weight}
+        self.weights = {}
+        # slot -> words of that record
+        self.words = []
+        # slot -> name words, for phrase matches
+        self.names = []
+        # word -> (clock, live records with the word from then on) pairs
+        self.counts = {}
+        # Sorted vocabulary, for prefix lookups; see sorted_add()
+        self.vocab = ([], [])
+        # trigram -> {length: words of that length containing it}
+        self.grams = {}
+        self._expansions = {}
+
+    @classmethod
+    def build(cls, stats):
+        index = cls()
+        weights = index.weights
+        for slot, stat in enumerate(stats):
+            record_weights = word_weights(stat)
+            index.words.append(tuple(record_weights))
+            index.names.append(name_phrase(stat))
+            for word, weight in record_weights.items():
+                weights.setdefault(word, {})[slot] = weight
+        index.counts = {word: [(0, len(postings))] for word, postings in weights.items()}
+        index.vocab = (sorted(weights), [])
+        for word in weights:
+            for gram in trigrams(word):
+                index.grams.setdefault(gram, {}).setdefault(len(word), []).append(word)
+        return index
+
+    def update(self, clock, removed, slot, stat):
+        """Indexes the record saved at clock in a new slot, replacing the removed slots.
+
+        Nothing is dropped: the postings of replaced records stay for the
+        snapshots that still see them, and a word no longer in any record
+        stays in the vocabulary with no live records.
+        """
+        changes = {}
+        for old_slot in removed:
+            for word in self.words[old_slot]:
+                changes[word] = changes.get(word, 0) - 1
+
+        record_weights = word_weights(stat)
+        self.words.append(tuple(record_weights))
+        self.names.append(name_phrase(stat))
+        for word, weight in record_weights.items():
+            postings = self.weights.get(word)
+            if postings is None:
+                self.weights[word] = {slot: weight}
+                self.vocab = sorted_add(self.vocab, word)
+                for gram in trigrams(word):
+                    self.grams.setdefault(gram, {}).setdefault(len(word), []).append(word)
+            else:
+                postings[slot] = weight
+            changes[word] = changes.get(word, 0) + 1
+
+        for word, change in changes.items():
+            if change:
+                history = self.counts.setdefault(word, [])
+                history.append((clock, (history[-1][1] if history else 0) + change))
+
+    def count(self, word, clock):
+        """Returns the number of records with word as of clock."""
+        history = self.counts.get(word)
+        if not history:
+            return 0
+        i = bisect.bisect_right(history, (clock, LIVE)) - 1
+        return history[i][1] if i >= 0 else 0
+
+    def expand(self, token, clock):
+        """Returns the vocabulary words matching a query word, with a quality from 0 to 1.
+
+        Only words some record has as of clock are matched.
+        """
+        found = self._expansions.get((token, clock))
+        if found is not None:
+            return found
+
+        found = {}
+        if self.count(token, clock):
+            found[token] = 1.0
+        if len(token) >= MIN_PREFIX_LENGTH:
+            # Prefix matches, found by bisecting the sorted vocabulary
+            for word in sorted_prefixed(self.vocab, token):
+                if word != token and self.count(word, clock):
+                    found[word] = 0.6 + 0.3 * len(token) / len(word)
+
+        if len(token) >= MIN_FUZZY_LENGTH:
+            for similarity, word in heapq.nlargest(MAX_EXPANSIONS, self._similar(token, clock, found)):
+                found[word] = 0.8 * similarity
+
+        if len(self._expansions) >= MEMO_SIZE:
+            self._expansions = {}
+        self._expansions[(token, clock)] = found
+        return found
+
+    def _similar(self, token, clock, found):
+        """Returns (similarity, word) pairs for the words a typo or two from token.
+
+        Not every such word, only enough to pick the closest ones: words
+        one typo away are all found first, and two typos away only if there
+        are too few of them.
+        """
+        limit = 2 if len(token) >= TWO_TYPO_LENGTH else 1
+        token_grams = trigrams(token)
+        lengths = range(len(token) - limit, len(token) + limit + 1)
+        postings = {}
+        for gram in token_grams:
+            by_length = self.grams.get(gram, {})
+            postings[gram] = [by_length.get(n, ()) for n in lengths]
+        rarest = sorted(token_grams, key=lambda gram: sum(map(len, postings[gram])))
+        similar = []
+        tried = set(found)
+        # Swapped letters are looked up directly, as swapping the middle two
+        # of a four letter word leaves it no trigram in common
+        for i in range(len(token) - 1):
+            word = token[:i] + token[i + 1] + token[i] + token[i + 2:]
+            if word not in tried and word in self.weights:
+                tried.add(word)
+                if self.count(word, clock):
+                    similar.append((1 - 1 / len(token), word))
+        for typos in range(1, limit + 1):
+            if sum(1 for similarity, word in similar
+                   if similarity > 1 - typos / len(token)) >= MAX_EXPANSIONS:
+                break
+            # A typo changes at most four trigrams, so a word this many typos
+            # away has all but 4 * typos of the token's, and so one of any
+            # 4 * typos + 1 of them
+            least = len(token_grams) - 4 * typos
+            for gram in rarest[:4 * typos + 1]:
+                for word in itertools.chain.from_iterable(postings[gram]):
+                    if word in tried or len(token_grams & trigrams(word)) < least:
+                        continue
+                    tried.add(word)
+                    distance = edit_distance(token, word, limit)
+                    if distance <= limit and self.count(word, clock):
+                        similar.append((1 - distance / len(token), word))
+        return similar
+
+    def scores(self, text, visible, records):
+        """Scores every visible record matching any word of text; returns {slot: score}.
+
+        records is the number of records visible. A matched word scores
+        its match quality times its field weight times its inverse document
+        frequency, and each query word counts its best match per record.
+        Names containing the whole query get a boost.
+        """
+        tokens = list(dict.fromkeys(TOKEN_RE.findall(text.lower())))
+        if not tokens:
+            return {}
+        clock = visible.clock
+        expanded = []
+        for token in tokens:
+            found = self.expand(token, clock)
+            counts = {word: self.count(word, clock) for word in found}
+            expanded.append((sum(counts.values()), token, found, counts))
+        # Rarest first, so common words can be limited to records already found
+        expanded.sort(key=lambda e: e[0])
+
+        totals = {}
+        for i, (size, token, found, counts) in enumerate(expanded):
+            scored = [(quality * math.log(1 + records / counts[word]), self.weights[word])
+                      for word, quality in found.items()]
+            best = {}
+            if i and size > records * COMMON_FRACTION:
+                for key in totals:
+                    for factor, postings in scored:
+                        weight = postings.get(key)
+                        if weight is not None and best.get(key, 0) < factor * weight:
+                            best[key] = factor * weight
+            else:
+                for factor, postings in scored:
+                    # Copied in one step, as saves may add to the postings meanwhile
+                    for key in visible.filter(list(postings)):
+                        score = factor * postings[key]
+                        if best.get(key, 0) < score:
+                            best[key] = score
+            for key, score in best.items():
+                totals[key] = totals.get(key, 0) + score
+
+        phrase = ' '.join(tokens)
+        names = self.names
+        for key in totals:
+            name = names[key]
+            if name == phrase:
+                totals[key] *= 2
+            elif phrase in name:
+                totals[key] *= 1.5
+        return totals
+
+
+# Number of suggestions returned when no limit is given, and the most allowed
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+
+
+def suggest_text(value):
+    """Normalizes a name for suggestions: lowercase words joined by single spaces."""
+    return ' '.join(TOKEN_RE.findall(str(value or '').lower()))
+
+
+def suggest_sources(s):
+    """Returns the ('card' or 'feature', name) pairs a statblock can be suggested as."""
+    sources = {('card', str(s.get('name') or '').strip())}
+    for f in s.get('features', []):
+        if isinstance(f, Mapping):
+            sources.add(('feature', str(f.get('name') or '').strip()))
+    return {(kind, name) for kind, name in sources if suggest_text(name)}
+
+
+def suggest_entries(kind, name):
+    """Returns the (list, text) entries of a suggestion.
+
+    A name is listed whole and from each later word on, so 'bur' finds
+    Acid Burrower too. Whole card names go in list 0, card names from a
+    later word in list 1, and feature names in lists 2 and 3.
+    """
+    words = suggest_text(name).split(' ')
+    first = 0 if kind == 'card' else 2
+    return [(first if i == 0 else first + 1, ' '.join(words[i:])) for i in range(len(words))]
+
+
+class SuggestIndex:
+    """Sorted lists of normalized card and feature names for typeahead.
+
+    A prefix is looked up by bisecting each list in turn, so a lookup costs
+    a few binary searches plus the suggestions returned, whatever the size
+    of the catalog. The index is shared by every snapshot of a catalog (see
+    Visibility), so saves only ever add to it: a name stays listed once no
+    record offers it, and is only suggested to the snapshots that see one
+    of the records that do.
+    """
+
+    __slots__ = ('owners', 'sources', 'lists')
+
+    def __init__(self):
+        # (kind, name) -> slots of the records offering it, ascending
+        self.owners = {}
+        # slot -> (kind, name) pairs of that record
+        self.sources = []
+        # (base, recent) pairs of sorted '<text>\0<kind>\0<name>' strings,
+        # best list first; see sorted_add()
+        self.lists = tuple(([], []) for _ in range(4))
+
+    @staticmethod
+    def _items(kind, name):
+        return [(i, f'{text}\0{kind}\0{name}') for i, text in suggest_entries(kind, name)]
+
+    @classmethod
+    def build(cls, stats):
+        index = cls()
+        owners = index.owners
+        for slot, stat in enumerate(stats):
+            sources = frozenset(suggest_sources(stat))
+            index.sources.append(sources)
+            for source in sources:
+                owners.setdefault(source, []).append(slot)
+        lists = ([], [], [], [])
+        for kind, name in owners:
+            for i, item in cls._items(kind, name):
+                lists[i].append(item)
+        index.lists = tuple((sorted(items), []) for items in lists)
+        return index
+
+    def update(self, clock, removed, slot, stat):
+        """Indexes the record saved at clock in a new slot.
+
+        Only names no record offered before are added to the sorted lists.
+        """
+        sources = frozenset(suggest_sources(stat))
+        self.sources.append(sources)
+        lists = None
+        for source in sources:
+            slots = self.owners.get(source)
+            if slots is not None:
+                slots.append(slot)
+                continue
+            self.owners[source] = [slot]
+            lists = lists or list(self.lists)
+            for i, item in self._items(*source):
+                lists[i] = sorted_add(lists[i], item)
+        if lists is not None:
+            self.lists = tuple(lists)
+
+    def suggest(self, text, visible, limit=SUGGEST_LIMIT):
+        """Returns up to limit (kind, name) suggestions for names starting with text.
+
+        Only names offered by a visible record are suggested. Card names
+        come before feature names, and names starting with text before
+        names with a later word starting with it; each group is in
+        alphabetical order.
+        """
+        prefix = suggest_text(text)
+        if not prefix or limit <= 0:
+            return []
+        owners = self.owners
+        found = []
+        seen = set()
+        for parts in self.lists:
+            for item in sorted_prefixed(parts, prefix):
+                _, kind, name = item.split('\0')
+                if (kind, name) in seen:
+                    continue
+                seen.add((kind, name))
+                if next(visible.filter(reversed(owners[(kind, name)])), None) is not None:
+                    found.append((kind, name))
+                    if len(found) >= limit:
+                        return found
+        return found
@@ -0,0 +1,407 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import argparse
+
+from records import to_json
+from search import SUGGEST_LIMIT, build_haystack, facet_of
+from store import (CHANGE_HISTORY, REBUILD_GARBAGE, Snapshot, StatblockStore, normalize_name,
+                   write_json_atomic)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS statblocks (
+    id INTEGER PRIMARY KEY,
+    name_key TEXT NOT NULL,
+    category TEXT,
+    tier INTEGER,
+    type TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS statblocks_name ON statblocks (name_key);
+CREATE INDEX IF NOT EXISTS statblocks_facet ON statblocks (category, tier, type);
+CREATE VIRTUAL TABLE IF NOT EXISTS statblocks_fts USING fts5 (haystack, tokenize='trigram');
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY, name TEXT);
+"""
+
+# The trigram tokenizer can only look up text of at least this many characters
+MIN_MATCH_LENGTH = 3
+
+
+class SqliteView:
+    """The statblock data as seen through the SQLite store.
+
+    Offers the same lookups as store.Snapshot, but answers each one with a
+    query instead of holding the records in memory. Every call sees the
+    data as of that call.
+    """
+
+    def __init__(self, store, version, modified):
+        self._store = store
+        self.version = version
+        self.tag = f"sqlite-{version}"
+        self.modified = modified
+
+    def _query(self, sql, params=()):
+        return self._store.connection().execute(sql, params)
+
+    def __iter__(self):
+        for (data,) in self._query('SELECT data FROM statblocks ORDER BY id'):
+            yield json.loads(data)
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM statblocks').fetchone()[0]
+
+    def get(self, name):
+        """Returns the first statblock with the given name, or None."""
+        row = self._query('SELECT data FROM statblocks WHERE name_key = ? ORDER BY id LIMIT 1',
+                          (normalize_name(name),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def search(self, category='', tier=None, type_='', text='', offset=0, limit=None):
+        """Returns a page of the records matching the /api/search filters.
+
+        Returns the records from offset up to limit, the facet counts and the
+        total number of matches.
+        """
+        text_from = 'statblocks s'
+        text_where = []
+        params = []
+        if text:
+            text_from += ' JOIN statblocks_fts f ON f.rowid = s.id'
+            if len(text) >= MIN_MATCH_LENGTH:
+                text_where.append('statblocks_fts MATCH ?')
+                params.append('"' + text.replace('"', '""') + '"')
+            # The trigram match ignores case only, check the exact substring too
+            text_where.append('instr(f.haystack, ?) > 0')
+            params.append(text)
+
+        counts = {'category': {}, 'tier': {}, 'type': {}}
+        where = ' AND '.join(text_where) or '1'
+        for field in ('category', 'tier', 'type'):
+            rows = self._query(f'SELECT s.{field}, COUNT(*) FROM {text_from} WHERE {where} '
+                               f'GROUP BY s.{field}', params)
+            for value, n in rows:
+                if value is not None and value != '':
+                    counts[field][str(value)] = n
+
+        filters = list(text_where)
+        filter_params = list(params)
+        if category:
+            filters.append('s.category = ?')
+            filter_params.append(category)
+        if tier:
+            try:
+                tier = int(tier)
+            except Exception:
+                return [], counts, 0
+            filters.append('s.tier = ?')
+            filter_params.append(tier)
+        if type_:
+            filters.append('s.type = ?')
+            filter_params.append(type_)
+
+        where = ' AND '.join(filters) or '1'
+        total = self._query(f'SELECT COUNT(*) FROM {text_from} WHERE {where}',
+                            filter_params).fetchone()[0]
+        rows = self._query(f'SELECT s.data FROM {text_from} WHERE {where} ORDER BY s.id '
+                           'LIMIT ? OFFSET ?',
+                           filter_params + [-1 if limit is None else limit, offset])
+        return [json.loads(data) for (data,) in rows], counts, total
+
+    def rank(self, text, category='', tier=None, type_='', offset=0, limit=20):
+        """Returns the best matches for text, like store.Snapshot.rank().
+
+        SQLite has no typo-tolerant search, so this loads the records into
+        an in-memory snapshot, which catches up with later saves.
+        """
+        return self._store.in_memory(self).rank(text, category, tier, type_, offset, limit)
+
+    def suggest(self, text, limit=SUGGEST_LIMIT):
+        """Returns name suggestions like store.Snapshot.suggest(), from the in-memory snapshot."""
+        return self._store.in_memory(self).suggest(text, limit)
+
+
+class SqliteStore:
+    """Statblock storage in a SQLite database.
+
+    Statblocks are kept as JSON with indexed name, category, tier and type
+    columns, and an FTS5 trigram index over the same text /api/search looks
+    at. Several worker processes can read the database at once without each
+    holding its own copy of the data. An empty database is filled from
+    default_path the first time it is opened.
+    """
+
+    def __init__(self, path, default_path=None):
+        self.path = path
+        self.default_path = default_path
+        self.stats = {'reads': 0, 'saves': 0}
+        self._local = threading.local()
+        self._ensured = False
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._listeners = []
+        self._memory = None
+        self._memory_lock = threading.Lock()
+        self._rebuilding = False
+
+    def connection(self):
+        """Returns this thread's connection to the database."""
+        conn = getattr(self._local, 'conn', None)
+        # A connection opened before a worker process was forked stays with the parent
+        if conn is None or self._local.pid != os.getpid():
+            self.ensure()
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    def ensure(self):
+        """Creates the database, importing the default data if it is new."""
+        with self._lock:
+            if self._ensured:
+                return
+            data_dir = os.path.dirname(self.path)
+            if data_dir and not os.path.isdir(data_dir):
+                os.makedirs(data_dir, exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.executescript(SCHEMA)
+                seeded = conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()
+                if seeded is None and self.default_path and os.path.isfile(self.default_path):
+                    with open(self.default_path, 'r', encoding='utf-8') as f:
+                        self._replace_all(conn, json.load(f))
+                # Databases made before the change history start it from now
+                conn.execute("INSERT OR IGNORE INTO meta (key, value) "
+                             "SELECT 'changes_from', value FROM meta WHERE key = 'seq'")
+            finally:
+                conn.close()
+            self._ensured = True
+
+    def _bump_seq(self, conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('seq', 1) "
+                     "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('modified', ?)",
+                     (time.time(),))
+        return conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]
+
+    def _insert(self, conn, stat):
+        category, tier, type_ = facet_of(stat)
+        cur = conn.execute(
+            'INSERT INTO statblocks (name_key, category, tier, type, data) VALUES (?, ?, ?, ?, ?)',
+            (normalize_name(stat.get('name')), category, tier, type_,
+             json.dumps(stat, ensure_ascii=False, default=to_json)))
+        conn.execute('INSERT INTO statblocks_fts (rowid, haystack) VALUES (?, ?)',
+                     (cur.lastrowid, build_haystack(stat)))
+
+    def snapshot(self):
+        """Returns a view of the data at the current version."""
+        self.stats['reads'] += 1
+        meta = dict(self.connection().execute(
+            "SELECT key, value FROM meta WHERE key IN ('seq', 'modified')"))
+        return SqliteView(self, meta.get('seq', 0), meta.get('modified', time.time()))
+
+    def in_memory(self, view):
+        """Returns an in-memory store.Snapshot of the data seen by view, or newer.
+
+        The snapshot is loaded once, then only the statblocks saved since
+        are read, from the change history, and saved to it.
+        """
+        with self._memory_lock:
+            memory = self._memory
+            if memory is None or memory.version < view.version:
+                memory = self._memory = self._caught_up(memory, view)
+            if memory.garbage() > max(len(memory), REBUILD_GARBAGE) and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild_memory, args=(memory,), daemon=True).start()
+            return memory
+
+    def _caught_up(self, memory, view):
+        conn = self.connection()
+        if memory is not None:
+            # One read transaction, so the saves and their statblocks agree
+            conn.execute('BEGIN')
+            try:
+                latest, changes = self.changes_since(memory.version)
+                items = self._saved(conn, changes) if changes is not None else None
+            finally:
+                conn.execute('COMMIT')
+            if items is not None:
+                return memory.with_upserts(items, latest)
+        return Snapshot.from_records(list(view), view.version, compact=True)
+
+    def _saved(self, conn, changes):
+        """Returns the (name, stat) pairs saved by changes, in the order last saved.
+
+        Returns None if one of them is no longer in the database.
+        """
+        names = {}
+        for _, name in changes:
+            key = normalize_name(name)
+            names.pop(key, None)
+            names[key] = name
+        items = []
+        for key, name in names.items():
+            row = conn.execute('SELECT data FROM statblocks WHERE name_key = ? ORDER BY id LIMIT 1',
+                               (key,)).fetchone()
+            if row is None:
+                return None
+            items.append((name, json.loads(row[0])))
+        return items
+
+    def _rebuild_memory(self, old):
+        """Replaces the in-memory snapshot with a copy without the statblocks saves replaced."""
+        try:
+            fresh = old.rebuilt()
+            with self._memory_lock:
+                memory = self._memory
+                items = memory.saved_since(old)
+                if items is not None:
+                    self._memory = fresh.with_upserts(items, memory.version)
+        finally:
+            self._rebuilding = False
+
+    def _replace_all(self, conn, records):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM statblocks')
+            conn.execute('DELETE FROM statblocks_fts')
+            for stat in records:
+                self._insert(conn, stat)
+            seq = self._bump_seq(conn)
+            conn.execute('DELETE FROM changes')
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('changes_from', ?)", (seq,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._notify()
+
+    def replace_all(self, records):
+        """Replaces the whole data set."""
+        self._replace_all(self.connection(), records)
+        self.stats['saves'] += 1
+
+    def upsert(self, name, stat):
+        """Saves a statblock, replacing any existing one called name.
+
+        The statblock gets a new id, so it moves to the end like it does in
+        the JSON data file.
+        """
+        self.upsert_many([(name, stat)])
+
+    def upsert_many(self, items):
+        """Saves a list of (name, stat) pairs in a single transaction."""
+        if not items:
+            return
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for name, stat in items:
+                key = normalize_name(name)
+                conn.execute('DELETE FROM statblocks_fts WHERE rowid IN '
+                             '(SELECT id FROM statblocks WHERE name_key = ?)', (key,))
+                conn.execute('DELETE FROM statblocks WHERE name_key = ?', (key,))
+                self._insert(conn, stat)
+                seq = self._bump_seq(conn)
+                conn.execute('INSERT INTO changes (seq, name) VALUES (?, ?)', (seq, name))
+            cutoff = seq - CHANGE_HISTORY
+            if conn.execute('DELETE FROM changes WHERE seq <= ?', (cutoff,)).rowcount:
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'changes_from'", (cutoff,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self.stats['saves'] += 1
+        self._notify()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+            for callback in self._listeners:
+                callback()
+
+    def changes_since(self, since):
+        """Returns the current save sequence number and the (seq, name) saves after since.
+
+        The saves are None when since is too old to catch up from.
+        """
+        conn = self.connection()
+        meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('seq', 'changes_from')"))
+        latest = meta.get('seq', 0)
+        if since is None:
+            return latest, []
+        if since > latest or since < meta.get('changes_from', 0):
+            return latest, None
+        rows = conn.execute('SELECT seq, name FROM changes WHERE seq > ? ORDER BY seq', (since,))
+        return latest, [tuple(row) for row in rows]
+
+    def wait_for_change(self, since, timeout, poll=1.0):
+        """Waits up to timeout seconds for a save after since, like changes_since().
+
+        Checks the database every poll seconds for saves by other processes.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            latest, changes = self.changes_since(since)
+            remaining = deadline - time.monotonic()
+            if changes is None or changes or remaining <= 0:
+                return latest, changes
+            with self._changed:
+                self._changed.wait(min(poll, remaining))
+
+    def add_listener(self, callback):
+        """Calls callback() from the saving thread after every save by this process."""
+        with self._changed:
+            self._listeners.append(callback)
+
+    def start_watcher(self, interval=1.0):
+        """Does nothing: every read already queries the shared database."""
+        return None
+
+    def export(self, path):
+        """Writes the data set to path in the JSON data file format."""
+        write_json_atomic(path, self.snapshot())
+
+    def info(self):
+        """Returns the store counters and the current data version."""
+        info = dict(self.stats)
+        snap = self.snapshot()
+        info['backend'] = 'sqlite'
+        info['version'] = snap.version
+        info['records'] = len(snap)
+        return info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import or export the SQLite statblock database.')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('json_file', help='JSON data file to import from or export to')
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                     'data', 'statblocks.db'))
+    args = parser.parse_args(argv)
+
+    store = SqliteStore(args.db)
+    if args.command == 'import':
+        if not os.path.isfile(args.json_file):
+            parser.error(f"{args.json_file} does not exist")
+        # Read through the JSON store so any journaled saves are included
+        records = list(StatblockStore(args.json_file).snapshot())
+        store.replace_all(records)
+        print(f"Imported {len(records)} statblocks into {args.db}")
+    else:
+        store.export(args.json_file)
+        print(f"Exported {len(store.snapshot())} statblocks to {args.json_file}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
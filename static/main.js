@@ -73,17 +73,81 @@ document.addEventListener('DOMContentLoaded', function () {
 
     // wire view buttons
     resultsDiv.querySelectorAll('.view-btn').forEach(btn => {
-      btn.addEventListener('click', () => {
-        const name = btn.dataset.name;
-        fetch(`/api/stat/${encodeURIComponent(name)}`)
+      btn.addEventListener('click', () => viewStat(btn.dataset.name));
+    });
+  }
+
+  function viewStat(name) {
+    fetch(`/api/stat/${encodeURIComponent(name)}`)
+      .then(r => r.json())
+      .then(data => {
+        currentStatName = data.name; // Store the name
+        if (formattedEl) formattedEl.innerHTML = formatStatblock(data);
+        const outputJson = transformToOutputJson(data);
+        if (formattedJsonEl) formattedJsonEl.value = JSON.stringify(outputJson, null, 2);
+      });
+  }
+
+  // Typeahead: suggest card and feature names while typing in the text search
+  const suggestionsEl = document.getElementById('suggestions');
+  if (textEl && suggestionsEl) {
+    let suggestTimer = null;
+    let suggestQuery = '';
+
+    function hideSuggestions() {
+      suggestionsEl.innerHTML = '';
+      suggestionsEl.classList.add('d-none');
+    }
+
+    function renderSuggestions(items) {
+      if (items.length === 0) {
+        hideSuggestions();
+        return;
+      }
+      suggestionsEl.innerHTML = items.map(it => `
+        <button type="button" class="list-group-item list-group-item-action" data-kind="${escapeHtml(it.kind)}" data-name="${escapeHtml(it.name)}">
+          ${escapeHtml(it.name)} <small class="text-muted">${it.kind === 'card' ? 'card' : 'feature'}</small>
+        </button>`).join('');
+      suggestionsEl.classList.remove('d-none');
+      suggestionsEl.querySelectorAll('button').forEach(btn => {
+        // mousedown, so the choice is made before the input loses focus
+        btn.addEventListener('mousedown', (ev) => {
+          ev.preventDefault();
+          hideSuggestions();
+          textEl.value = btn.dataset.name;
+          if (btn.dataset.kind === 'card') {
+            viewStat(btn.dataset.name);
+          } else if (searchBtn) {
+            searchBtn.click();
+          }
+        });
+      });
+    }
+
+    textEl.addEventListener('input', () => {
+      clearTimeout(suggestTimer);
+      const q = textEl.value.trim();
+      if (!q) {
+        hideSuggestions();
+        return;
+      }
+      suggestTimer = setTimeout(() => {
+        suggestQuery = q;
+        fetch(`/api/suggest?q=${encodeURIComponent(q)}&limit=8`)
           .then(r => r.json())
           .then(data => {
-            currentStatName = data.name; // Store the name
-            if (formattedEl) formattedEl.innerHTML = formatStatblock(data);
-            const outputJson = transformToOutputJson(data);
-            if (formattedJsonEl) formattedJsonEl.value = JSON.stringify(outputJson, null, 2);
+            // Ignore answers to queries the user has typed past
+            if (q === suggestQuery) renderSuggestions(data.suggestions || []);
           });
-      });
+      }, 100);
+    });
+    textEl.addEventListener('blur', hideSuggestions);
+    textEl.addEventListener('keydown', (ev) => {
+      if (ev.key === 'Escape') hideSuggestions();
+      if (ev.key === 'Enter') {
+        hideSuggestions();
+        if (searchBtn) searchBtn.click();
+      }
     });
   }
 
@@ -0,0 +1,1133 @@
+import gc
+import io
+import os
+import json
+import time
+import zlib
+import heapq
+import pickle
+import itertools
+import shutil
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from records import Record, freeze, layout, record_hook, to_json
+from search import (LIVE, SUGGEST_LIMIT, FacetIndex, RankedIndex, SearchIndex, SuggestIndex,
+                    Visibility)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Replaced records kept before the store rebuilds a snapshot without them, at least
+REBUILD_GARBAGE = 1000
+# Saves remembered for clients catching up on changes
+CHANGE_HISTORY = 1000
+# Version of the binary cache file layout
+CACHE_FORMAT = 1
+
+
+def normalize_name(name):
+    """Returns the key used to look up a statblock by name."""
+    return str(name or '').strip().lower()
+
+
+class _Catalog:
+    """The records of a line of snapshots, shared between all of them.
+
+    Every record goes in a new slot at the end, in file order, and a save
+    marks the slots it replaces as dead from the save's clock on; nothing
+    else is ever changed. A snapshot sees the slots that were alive at its
+    clock (see search.Visibility), so saving never copies the records of
+    the snapshot saved to, which keeps serving readers as before.
+
+    The catalog starts at clock 0 with first records, and the save at
+    clock c puts its record in slot first + c - 1.
+    """
+
+    __slots__ = ('stats', 'keys', 'died', 'slots', 'shadowed', 'first', 'removed', 'clock',
+                 'facets', 'search', 'ranked', 'suggest', 'building', 'lock')
+
+    def __init__(self):
+        self.stats = []
+        self.keys = []
+        self.died = []
+        # key -> every slot the key has had, ascending
+        self.slots = {}
+        # key -> keys of the later records with the same name
+        self.shadowed = {}
+        self.first = 0
+        # clock -> slots replaced by the save at that clock
+        self.removed = [()]
+        # Clock of the latest snapshot; a save makes the next one
+        self.clock = 0
+        self.facets = None
+        # Built on first use, then kept up to date by every save
+        self.search = None
+        self.ranked = None
+        self.suggest = None
+        # Attribute name -> Event set when the build of that index ends
+        self.building = {}
+        self.lock = threading.Lock()
+
+    def append(self, key, stat):
+        """Adds a record in a new slot, returning the slot."""
+        slot = len(self.stats)
+        self.stats.append(stat)
+        self.keys.append(key)
+        self.died.append(LIVE)
+        slots = self.slots.get(key)
+        if slots is None:
+            self.slots[key] = [slot]
+        else:
+            slots.append(slot)
+        return slot
+
+    def save(self, key, stat):
+        """Saves stat in place of the live records called key, at the next clock.
+
+        Returns the slots replaced and the new slot. The caller holds the
+        lock, and moves the clock on once done.
+        """
+        clock = self.clock + 1
+        removed = []
+        for k in [key] + self.shadowed.pop(key, []):
+            slots = self.slots.get(k)
+            # Only the latest slot of a key can still be alive
+            if slots and self.died[slots[-1]] == LIVE:
+                self.died[slots[-1]] = clock
+                removed.append(slots[-1])
+        slot = self.append(key, stat)
+        self.removed.append(tuple(removed))
+        for index in (self.search, self.ranked, self.suggest):
+            if index is not None:
+                index.update(clock, removed, slot, stat)
+        return removed, slot
+
+    def index(self, name, build):
+        """Returns the index kept in attribute name, building it on first use.
+
+        The index is built from the first records and then replays the
+        saves since, without the lock so saves carry on meanwhile. The last
+        ones are replayed under the lock, before the index is published.
+        Only one thread builds each index; the others wait for it.
+        """
+        while True:
+            with self.lock:
+                index = getattr(self, name)
+                if index is not None:
+                    return index
+                pending = self.building.get(name)
+                if pending is None:
+                    pending = self.building[name] = threading.Event()
+                    break
+            # Try again if the build failed
+            pending.wait()
+        try:
+            index = build(self.stats[:self.first])
+            done = self._replay(index, 0, self.clock)
+            with self.lock:
+                self._replay(index, done, self.clock)
+                setattr(self, name, index)
+        finally:
+            with self.lock:
+                del self.building[name]
+            pending.set()
+        return index
+
+    def _replay(self, index, done, clock):
+        for c in range(done + 1, clock + 1):
+            slot = self.first + c - 1
+            index.update(c, self.removed[c], slot, self.stats[slot])
+        return clock
+
+
+class Snapshot:
+    """An immutable view of the statblock data at one data version.
+
+    Records are kept in file order in a catalog shared with the snapshots
+    the store makes from this one by saving, which looks them up by
+    normalized name. Later records sharing a name are kept under (name, n)
+    keys so they are still listed and saved but, as before, never returned
+    by a name lookup. The records are shared between every request that
+    holds the snapshot, so callers must copy a record before modifying it.
+    A compact snapshot keeps its records as read-only records.Record
+    objects, which take less memory and turn into plain dicts when deep
+    copied.
+    """
+
+    __slots__ = ('_catalog', '_visible', '_size', '_counts', 'compact', 'version', 'tag',
+                 'modified')
+
+    def __init__(self, catalog, visible, size, counts, version, compact=False):
+        self._catalog = catalog
+        self._visible = visible
+        self._size = size
+        # Visible records per facet
+        self._counts = counts
+        self.compact = compact
+        self.version = version
+        # Set by the store: a data version that is the same in every process
+        # reading the same files, and the time the data last changed.
+        self.tag = None
+        self.modified = None
+
+    @classmethod
+    def from_records(cls, records, version, compact=False):
+        catalog = _Catalog()
+        slots = catalog.slots
+        shadowed = catalog.shadowed
+        for stat in records:
+            if compact:
+                stat = freeze(stat)
+            key = normalize_name(stat.get('name'))
+            if key in slots:
+                keys = shadowed.setdefault(key, [])
+                key = (key, len(keys))
+                keys.append(key)
+            catalog.append(key, stat)
+        catalog.first = len(catalog.stats)
+        catalog.facets = FacetIndex.build(catalog.stats)
+        counts = {facet: len(slots) for facet, slots in catalog.facets.buckets.items()}
+        size = len(catalog.stats)
+        return cls(catalog, Visibility(size, 0, catalog.died), size, counts, version,
+                   compact=compact)
+
+    def __iter__(self):
+        visible = self._visible
+        alive = map(visible.clock.__lt__, itertools.islice(self._catalog.died, visible.limit))
+        return itertools.compress(itertools.islice(self._catalog.stats, visible.limit), alive)
+
+    def __len__(self):
+        return self._size
+
+    def get(self, name):
+        """Returns the first statblock with the given name, or None."""
+        catalog = self._catalog
+        visible = self._visible
+        for slot in reversed(catalog.slots.get(normalize_name(name), ())):
+            if slot < visible.limit:
+                return catalog.stats[slot] if catalog.died[slot] > visible.clock else None
+        return None
+
+    def with_upsert(self, name, stat, version):
+        """Returns a new snapshot with stat replacing every record called name.
+
+        The replaced statblock moves to the end, matching the order the data
+        file has always been saved in.
+        """
+        key = normalize_name(name)
+        catalog = self._catalog
+        with catalog.lock:
+            if catalog.clock != self._visible.clock:
+                # Saved to before, so the catalog has moved on: start a new one
+                return Snapshot.from_records(_replay(list(self), [(name, stat)]), version,
+                                             self.compact)
+            if self.compact:
+                stat = freeze(stat)
+            removed, slot = catalog.save(key, stat)
+            facets = catalog.facets
+            counts = dict(self._counts)
+            for old_slot in removed:
+                facet = facets.facets[old_slot]
+                counts[facet] -= 1
+                if not counts[facet]:
+                    del counts[facet]
+            facet = facets.add(slot, stat)
+            counts[facet] = counts.get(facet, 0) + 1
+            catalog.clock += 1
+            visible = Visibility(slot + 1, catalog.clock, catalog.died)
+        return Snapshot(catalog, visible, self._size - len(removed) + 1, counts, version,
+                        self.compact)
+
+    def with_upserts(self, items, version):
+        """Returns a new snapshot with every (name, stat) in items saved in turn."""
+        snap = self
+        for name, stat in items:
+            snap = snap.with_upsert(name, stat, version)
+        return snap
+
+    def garbage(self):
+        """Returns the number of replaced records the catalog still keeps for this snapshot."""
+        return self._visible.limit - self._size
+
+    def rebuilt(self):
+        """Returns a copy of the snapshot without replaced records, and the same indexes built."""
+        snap = Snapshot.from_records(list(self), self.version, self.compact)
+        if self._catalog.search is not None:
+            snap.search_index()
+        if self._catalog.ranked is not None:
+            snap.ranked_index()
+        if self._catalog.suggest is not None:
+            snap.suggest_index()
+        snap.tag = self.tag
+        snap.modified = self.modified
+        return snap
+
+    def saved_since(self, older):
+        """Returns the (key, stat) saves made from older to this snapshot, in order.
+
+        Returns None if this snapshot was not made from older by saving.
+        """
+        catalog = self._catalog
+        if older._catalog is not catalog or older._visible.clock > self._visible.clock:
+            return None
+        later = range(older._visible.limit, self._visible.limit)
+        return [(catalog.keys[slot], catalog.stats[slot]) for slot in self._visible.filter(later)]
+
+    def search_index(self):
+        """Returns the text search index, building it on first use."""
+        return self._catalog.index('search', SearchIndex.build)
+
+    def search(self, category='', tier=None, type_='', text='', offset=0, limit=None):
+        """Returns a page of the records matching the /api/search filters.
+
+        Returns the records from offset up to limit, the facet counts and the
+        total number of matches. The facet counts cover every record matching
+        the text, whatever the category, tier and type filters are, so a
+        client can show how many results each filter would give.
+        """
+        facets = self._catalog.facets
+        if text:
+            matched = self.search_index().search(text, self._visible)
+            counts = facets.counts(facets.sizes(matched))
+        else:
+            counts = facets.counts(self._counts)
+
+        if tier:
+            try:
+                tier = int(tier)
+            except Exception:
+                return [], counts, 0
+        else:
+            tier = None
+
+        end = None if limit is None else offset + limit
+        if not text:
+            slots, total = facets.select(category, tier, type_, self._visible, self._counts,
+                                         offset, end)
+        else:
+            slots = sorted(slot for slot in matched
+                           if facets.matches(facets.facets[slot], category, tier, type_))
+            total = len(slots)
+            slots = slots[offset:end]
+
+        stats = self._catalog.stats
+        return [stats[slot] for slot in slots], counts, total
+
+    def ranked_index(self):
+        """Returns the ranked search index, building it on first use."""
+        return self._catalog.index('ranked', RankedIndex.build)
+
+    def rank(self, text, category='', tier=None, type_='', offset=0, limit=20):
+        """Returns the best matches for text, best first, with their scores.
+
+        Returns (stat, score) pairs from offset up to limit, the facet counts
+        of every record matching text, and the number of matches after the
+        category, tier and type filters.
+        """
+        scores = self.ranked_index().scores(text, self._visible, self._size)
+        return rank_scores(scores, self._catalog.stats, self._catalog.facets, category, tier,
+                           type_, offset, limit)
+
+    def suggest_index(self):
+        """Returns the typeahead index, building it on first use."""
+        return self._catalog.index('suggest', SuggestIndex.build)
+
+    def suggest(self, text, limit=SUGGEST_LIMIT):
+        """Returns up to limit (kind, name) card and feature names starting with text."""
+        return self.suggest_index().suggest(text, self._visible, limit)
+
+
+def rank_scores(scores, stats, facets, category, tier, type_, offset, limit):
+    """Filters and orders the scores of a ranked search; see Snapshot.rank()."""
+    counts = facets.counts(facets.sizes(scores))
+    if tier:
+        try:
+            tier = int(tier)
+        except Exception:
+            return [], counts, 0
+    else:
+        tier = None
+    slots = [slot for slot in scores
+             if facets.matches(facets.facets[slot], category, tier, type_)]
+    # Ties go to the record that comes first in the file
+    best = heapq.nsmallest(offset + limit, slots, key=lambda s: (-scores[s], s))
+    return [(stats[slot], round(scores[slot], 4)) for slot in best[offset:]], counts, len(slots)
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _fsync_dir(path):
+    # Makes a rename durable; not supported on every platform.
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _tmp_path(path):
+    # Unique per process and thread, so concurrent writers never share one
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _write_json(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(list(records), f, indent=2, ensure_ascii=False, default=to_json)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@contextmanager
+def _gc_paused():
+    # Loading allocates millions of objects and no cycles, so collecting
+    # garbage meanwhile only costs time.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class _CacheUnpickler(pickle.Unpickler):
+    """Unpickles plain data and compact records, and nothing else."""
+
+    allowed = {('records', 'Record'): Record, ('records', 'layout'): layout}
+
+    def find_class(self, module, name):
+        found = self.allowed.get((module, name))
+        if found is not None:
+            return found
+        raise pickle.UnpicklingError(f'{module}.{name} is not allowed in the cache')
+
+
+def write_cache(path, records, source, compact):
+    """Writes records to a binary cache of the data file whose os.stat() is source.
+
+    The cache is a JSON header line, naming the data file version and a
+    checksum, followed by the pickled records.
+    """
+    payload = pickle.dumps(list(records), protocol=pickle.HIGHEST_PROTOCOL)
+    header = {'format': CACHE_FORMAT, 'source': list(source), 'compact': compact,
+              'length': len(payload), 'crc32': zlib.crc32(payload)}
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def read_cache(path, source, compact):
+    """Returns the records in a binary cache, or None if it is missing, stale or damaged."""
+    try:
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            payload = f.read()
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(header, dict) or header.get('format') != CACHE_FORMAT
+            or header.get('source') != list(source) or header.get('compact') != compact
+            or header.get('length') != len(payload) or header.get('crc32') != zlib.crc32(payload)):
+        return None
+    try:
+        with _gc_paused():
+            return _CacheUnpickler(io.BytesIO(payload)).load()
+    except Exception:
+        return None
+
+
+def write_json_atomic(path, records):
+    """Writes records as an indented JSON list, replacing path atomically."""
+    tmp_path = _tmp_path(path)
+    _write_json(tmp_path, records)
+    os.replace(tmp_path, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+class FileLock:
+    """An exclusive lock shared by every process that opens the same lock file.
+
+    Re-entrant within a process: nested uses only lock the file once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._depth = 0
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                f = open(self.path, 'a+b')
+                try:
+                    if fcntl:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    else:
+                        f.seek(0)
+                        while True:
+                            try:
+                                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                                break
+                            except OSError:
+                                # LK_LOCK gives up after ten seconds
+                                continue
+                except BaseException:
+                    f.close()
+                    raise
+            except BaseException:
+                self._lock.release()
+                raise
+            self._file = f
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            f, self._file = self._file, None
+            try:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                f.close()
+        self._lock.release()
+
+
+def _parse_journal(data):
+    """Parses complete journal lines, returning the entries and bytes consumed.
+
+    A trailing line without a newline is still being written (or was torn by
+    a crash) and is left for the next read. Unreadable lines are skipped.
+    """
+    end = data.rfind(b'\n') + 1
+    entries = []
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries, end
+
+
+def _changes_of(entries):
+    return [(entry.get('seq', 0), entry.get('name')) for entry in entries
+            if entry.get('op') == 'upsert']
+
+
+def _replay(records, upserts):
+    """Applies journaled upserts to the records loaded from the data file."""
+    if not upserts:
+        return records
+    latest = {}
+    for name, stat in upserts:
+        key = normalize_name(name)
+        # Every save moves the statblock to the end
+        latest.pop(key, None)
+        latest[key] = stat
+    kept = [s for s in records if normalize_name(s.get('name')) not in latest]
+    return kept + list(latest.values())
+
+
+def _saves_between(snap, records):
+    """Returns the (name, stat) saves that turn snap into records, in order.
+
+    Saves move statblocks to the end, so records must be the statblocks of
+    snap that were kept, in the same order, followed by one statblock for
+    each name saved. Returns None if records are not made that way, or
+    mostly differ from snap.
+    """
+    kept = 0
+    replaced = set()
+    for stat in snap:
+        # Names first, as comparing whole statblocks is slower
+        if (kept < len(records) and stat.get('name') == records[kept].get('name')
+                and stat == records[kept]):
+            kept += 1
+        else:
+            replaced.add(normalize_name(stat.get('name')))
+    if len(records) - kept > kept:
+        # Saving more statblocks than were kept costs more than loading them afresh
+        return None
+    saved = [normalize_name(stat.get('name')) for stat in records[kept:]]
+    names = set(saved)
+    if len(names) != len(saved) or not replaced <= names:
+        return None
+    if any(normalize_name(stat.get('name')) in names for stat in records[:kept]):
+        return None
+    return [(stat.get('name'), stat) for stat in records[kept:]]
+
+
+class ChangeLog:
+    """The most recent saves, as (seq, name) pairs, for clients following changes.
+
+    Holds every save after sequence number start. Threads can wait for new
+    saves, and listeners are called, from the saving thread, whenever the
+    log changes; they must return quickly.
+    """
+
+    def __init__(self, size=CHANGE_HISTORY):
+        self.size = size
+        self.start = None
+        self._changes = deque()
+        self._cond = threading.Condition()
+        self._listeners = []
+
+    def _latest(self):
+        return self._changes[-1][0] if self._changes else self.start
+
+    def add_listener(self, callback):
+        with self._cond:
+            self._listeners.append(callback)
+
+    def _notify(self):
+        self._cond.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    def reset(self, seq):
+        """Forgets every save; clients from before seq must reload everything."""
+        with self._cond:
+            self._changes.clear()
+            self.start = seq
+            self._notify()
+
+    def add(self, changes, start=None):
+        """Adds saves after the latest one in the log.
+
+        start is the sequence number changes follow on from, when known; if
+        the log does not reach it, the saves in between are unknown and the
+        log starts over from there.
+        """
+        with self._cond:
+            latest = self._latest()
+            changed = False
+            if start is not None and (latest is None or latest < start):
+                self._changes.clear()
+                self.start = latest = start
+                changed = True
+            for seq, name in changes:
+                if latest is not None and seq <= latest:
+                    continue
+                if len(self._changes) >= self.size:
+                    self.start = self._changes.popleft()[0]
+                self._changes.append((seq, name))
+                latest = seq
+                changed = True
+            if changed:
+                self._notify()
+
+    def since(self, since):
+        """Returns the latest sequence number and the saves after since.
+
+        The saves are None when since is older than the log, or newer than
+        the latest save, in which case the client has to reload everything.
+        With since None, returns no saves.
+        """
+        with self._cond:
+            latest = self._latest() or 0
+            if since is None:
+                return latest, []
+            if since > latest or since < (self.start or 0):
+                return latest, None
+            return latest, [change for change in self._changes if change[0] > since]
+
+    def wait(self, since, timeout):
+        """Waits up to timeout seconds for a save after since."""
+        with self._cond:
+            latest = self._latest()
+            if since is None or latest is None or latest <= since:
+                self._cond.wait(timeout)
+
+
+class StatblockStore:
+    """Process-wide cache of the statblock data file.
+
+    The file is parsed once and re-read only when it changes on disk. Saves
+    are appended to a journal next to the data file instead of rewriting it,
+    and the journal is folded back into the data file in the background once
+    it grows past compact_after entries. Both files are written with fsync
+    and the data file is only ever replaced by an atomic rename, so it always
+    holds a complete JSON list in the usual format.
+
+    Several processes can share the files: appends, compactions and full
+    rewrites hold an exclusive lock on a lock file next to the data file,
+    and each process picks up the others' saves when it next checks the
+    files, or sooner with start_watcher(). With compact_records the
+    snapshots hold records.Record objects rather than dicts.
+
+    Parsing a large data file is slow, so with write_cache, after parsing it
+    the store writes the records to a binary cache next to it. A current
+    cache is loaded instead of the data file for as long as the data file
+    is unchanged.
+    """
+
+    def __init__(self, path, default_path=None, journal_path=None, compact_after=200,
+                 compact_records=False, write_cache=False):
+        self.path = path
+        self.default_path = default_path
+        self.journal_path = journal_path or os.path.splitext(path)[0] + '.journal'
+        self.cache_path = os.path.splitext(path)[0] + '.cache'
+        self.file_lock = FileLock(os.path.splitext(path)[0] + '.lock')
+        self.compact_after = compact_after
+        self.compact_records = compact_records
+        self.write_cache = write_cache
+        self.stats = {'reloads': 0, 'cache_loads': 0, 'journal_reads': 0, 'hits': 0, 'saves': 0,
+                      'compactions': 0, 'catch_ups': 0, 'rebuilds': 0}
+        # The snapshot and the file signatures it was loaded from, swapped
+        # together so readers never pair a snapshot with the wrong signature.
+        self._current = (None, None)
+        self._version = 0
+        # Journal read position, entries since the last compaction and last save sequence
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._seq = 0
+        # Sequence number of the checkpoint starting the journal last read
+        self._checkpoint = None
+        self._compacting = False
+        self._rebuilding = False
+        self._watcher = None
+        self._ensured = False
+        self.changes = ChangeLog()
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+
+    def ensure(self):
+        """Creates the data file from the default data if it does not exist.
+
+        Checks the disk once; later calls return straight away.
+        """
+        if self._ensured:
+            return
+        data_dir = os.path.dirname(self.path)
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir, exist_ok=True)
+
+        if not os.path.isfile(self.path):
+            with self.file_lock:
+                # Another process may have created it while we waited.
+                if not os.path.isfile(self.path):
+                    tmp_path = _tmp_path(self.path)
+                    if self.default_path and os.path.isfile(self.default_path):
+                        shutil.copy(self.default_path, tmp_path)
+                    else:
+                        _write_json(tmp_path, [])
+                    os.replace(tmp_path, self.path)
+        self._ensured = True
+
+    def _signature(self):
+        return (_stat(self.path), _stat(self.journal_path))
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        """Returns the current snapshot, reloading the files if they changed."""
+        snap, loaded_signature = self._current
+        if snap is not None and self._signature() == loaded_signature:
+            self._count('hits')
+            return snap
+
+        with self._lock:
+            # Another thread may have reloaded while we waited for the lock.
+            snap, loaded_signature = self._current
+            signature = self._signature()
+            if snap is not None and signature == loaded_signature:
+                self._count('hits')
+                return snap
+
+            if snap is not None and self._journal_grew(loaded_signature, signature):
+                # Only another process's saves were appended, read just those
+                self._count('journal_reads')
+                return self._read_journal_tail(snap, signature)
+
+            self.ensure()
+            signature = self._signature()
+            if signature[0] is None:
+                # The data file was removed while running, so make it again
+                self._ensured = False
+                self.ensure()
+                signature = self._signature()
+            with _gc_paused():
+                return self._reload(signature, snap)
+
+    def _reload(self, signature, snap=None):
+        """Loads the data file, replays the journal over it and publishes the result.
+
+        Where the result only differs from snap by saves, as after another
+        process compacted the files, they are saved to snap instead, which
+        keeps its catalog and the indexes built on it.
+        """
+        entries = self._read_journal(0)
+        seq = self._seq
+        self._journal_entries = 0
+        upserts = []
+        checkpoint = None
+        for entry in entries:
+            self._apply_seq(entry)
+            if entry.get('op') == 'upsert':
+                upserts.append((entry.get('name'), entry.get('stat')))
+            elif entry.get('op') == 'checkpoint' and checkpoint is None:
+                checkpoint = entry.get('seq', 0)
+        compacted = checkpoint is not None and checkpoint != self._checkpoint
+        self._checkpoint = checkpoint
+        changes = _changes_of(entries)
+        if checkpoint is None:
+            # A journal without a checkpoint holds every save since the data file was made
+            checkpoint = changes[0][0] - 1 if changes else self._seq
+        self.changes.add(changes, start=checkpoint)
+        if snap is not None and compacted and checkpoint <= seq:
+            # A new journal after saves this process has read, which the data file holds
+            items = [(entry.get('name'), entry.get('stat')) for entry in entries
+                     if entry.get('op') == 'upsert' and entry.get('seq', 0) > seq]
+            return self._publish_saves(snap, items, signature)
+        records = _replay(self._load_data(signature[0]), upserts)
+        if snap is not None:
+            items = _saves_between(snap, records)
+            if items is not None:
+                return self._publish_saves(snap, items, signature)
+        self._count('reloads')
+        return self._publish(records, signature)
+
+    def _publish_saves(self, snap, items, signature):
+        """Publishes snap with the (name, stat) pairs in items saved to it."""
+        if items:
+            self._version += 1
+            snap = snap.with_upserts(items, self._version)
+        self._stamp(snap, signature)
+        self._current = (snap, signature)
+        self._count('catch_ups')
+        self._rebuild_if_wasteful(snap)
+        return snap
+
+    def _load_data(self, data_stat):
+        """Returns the records in the data file, from the binary cache if it is current."""
+        data = read_cache(self.cache_path, data_stat, self.compact_records)
+        if data is not None:
+            self._count('cache_loads')
+            return data
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            # The cache is labelled with the file actually read, even if it is replaced meanwhile
+            st = os.fstat(f.fileno())
+            # Compact records are made while parsing, without building dicts first
+            data = json.load(f, object_hook=record_hook if self.compact_records else None)
+        if self.write_cache:
+            source = (st.st_ino, st.st_mtime_ns, st.st_size)
+            threading.Thread(target=self._write_cache, args=(data, source), daemon=True).start()
+        return data
+
+    def _write_cache(self, records, source):
+        try:
+            write_cache(self.cache_path, records, source, self.compact_records)
+        except OSError:
+            # Only a cache: the next load parses the data file again
+            pass
+
+    def _journal_grew(self, old, new):
+        if old is None:
+            return False
+        old_data, old_journal = old
+        new_data, new_journal = new
+        return (old_data == new_data and old_journal is not None and new_journal is not None
+                and old_journal[0] == new_journal[0] and new_journal[2] >= self._journal_offset)
+
+    def _read_journal(self, offset):
+        """Reads the journal entries after offset and moves the read position."""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            self._journal_offset = 0
+            return []
+        entries, consumed = _parse_journal(data)
+        self._journal_offset = offset + consumed
+        return entries
+
+    def _apply_seq(self, entry):
+        self._seq = max(self._seq, entry.get('seq', 0))
+        if entry.get('op') == 'upsert':
+            self._journal_entries += 1
+
+    def _read_journal_tail(self, snap, signature):
+        entries = self._read_journal(self._journal_offset)
+        for entry in entries:
+            self._apply_seq(entry)
+            if entry.get('op') == 'upsert':
+                self._version += 1
+                snap = snap.with_upsert(entry.get('name'), entry.get('stat'), self._version)
+        self.changes.add(_changes_of(entries))
+        self._stamp(snap, signature)
+        self._current = (snap, signature)
+        self._rebuild_if_wasteful(snap)
+        return snap
+
+    def _publish(self, records, signature):
+        self._version += 1
+        snap = Snapshot.from_records(records, self._version, self.compact_records)
+        self._stamp(snap, signature)
+        self._current = (snap, signature)
+        return snap
+
+    def _stamp(self, snap, signature, modified=None):
+        # The save sequence identifies the journaled changes and the data
+        # file's signature catches the file being replaced or edited.
+        data_stat = signature[0] if signature else None
+        snap.tag = f"{self._seq}-{zlib.crc32(repr(data_stat).encode('utf-8')):08x}"
+        if modified is None:
+            mtimes = [st[1] for st in signature or () if st is not None]
+            modified = max(mtimes) / 1e9 if mtimes else time.time()
+        snap.modified = modified
+
+    def _append(self, entries):
+        """Appends entries to the journal with one write and syncs it to disk."""
+        line = ''.join(json.dumps(entry, ensure_ascii=False, default=to_json) + '\n'
+                       for entry in entries).encode('utf-8')
+        with open(self.journal_path, 'ab+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                # Never continue a line torn by a crash
+                f.seek(size - 1)
+                if f.read(1) != b'\n':
+                    line = b'\n' + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            end = f.tell()
+        # Keep our read position past our own entry, unless another process
+        # appended in between; then the next read picks both up again.
+        return end if size == self._journal_offset else None
+
+    def _reset_journal(self, seq, tail=b''):
+        """Starts a new journal whose entries follow on from seq."""
+        checkpoint = json.dumps({'seq': seq, 'op': 'checkpoint'}) + '\n'
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(checkpoint.encode('utf-8'))
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+            end = f.tell()
+        os.replace(tmp_path, self.journal_path)
+        _fsync_dir(os.path.dirname(self.journal_path))
+        self._journal_offset = end
+        self._checkpoint = seq
+
+    def replace_all(self, records):
+        """Replaces the whole data set and writes it to disk."""
+        self.ensure()
+        with self._lock, self.file_lock:
+            # Carry on from the last sequence number any process saved
+            for entry in self._read_journal(0):
+                self._apply_seq(entry)
+            write_json_atomic(self.path, records)
+            self._seq += 1
+            self._reset_journal(self._seq)
+            self._journal_entries = 0
+            self._publish(records, self._signature())
+            self.changes.reset(self._seq)
+            self._count('saves')
+
+    def upsert(self, name, stat):
+        """Saves a statblock, replacing any existing one called name."""
+        self.upsert_many([(name, stat)])
+
+    def upsert_many(self, items):
+        """Saves a list of (name, stat) pairs with a single journal write."""
+        if not items:
+            return
+        self.ensure()
+        with self._lock:
+            with self.file_lock:
+                # Catch up with other processes' saves first, so sequence numbers
+                # carry on from theirs.
+                snap = self.snapshot()
+                signature = self._current[1]
+                entries = []
+                for name, stat in items:
+                    self._seq += 1
+                    entries.append({'seq': self._seq, 'op': 'upsert', 'name': name, 'stat': stat})
+                end = self._append(entries)
+                if end is not None:
+                    self._journal_offset = end
+                    # Taken while no other process can append after our entries
+                    signature = self._signature()
+                # Otherwise keep the old signature, so the next read replays
+                # the journal from before both appends.
+            # The saves are on disk, so other processes need not wait while
+            # this one updates its snapshot.
+            self._journal_entries += len(entries)
+            self._version += 1
+            snap = snap.with_upserts(items, self._version)
+            self._stamp(snap, signature, time.time())
+            self._current = (snap, signature)
+            self.changes.add(_changes_of(entries))
+            self._count('saves')
+
+            if self._journal_entries >= self.compact_after and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._compact_in_background, daemon=True).start()
+            self._rebuild_if_wasteful(snap)
+
+    def _rebuild_if_wasteful(self, snap):
+        """Starts rebuilding the snapshot in the background once replaced records pile up.
+
+        Saves keep every replaced record in the snapshots' shared catalog,
+        so once there are more of them than live ones, a copy without them
+        is built while the old one keeps serving, and takes over after
+        catching up with the saves made meanwhile.
+        """
+        if snap.garbage() > max(len(snap), REBUILD_GARBAGE) and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, args=(snap,), daemon=True).start()
+
+    def _rebuild(self, old):
+        try:
+            fresh = old.rebuilt()
+            with self._lock:
+                snap, signature = self._current
+                items = snap.saved_since(old)
+                if items is None:
+                    # Reloaded meanwhile, so the current snapshot is new anyway
+                    return
+                fresh = fresh.with_upserts(items, snap.version)
+                fresh.tag = snap.tag
+                fresh.modified = snap.modified
+                self._current = (fresh, signature)
+                self._count('rebuilds')
+        finally:
+            self._rebuilding = False
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """Folds the journal into the data file.
+
+        The data file is written outside the lock so saves can carry on; any
+        entries appended meanwhile are copied into the new journal.
+        """
+        with self._lock:
+            snap = self.snapshot()
+            loaded = self._current[1]
+            offset = self._journal_offset
+            seq = self._seq
+            entries = self._journal_entries
+
+        tmp_path = _tmp_path(self.path)
+        _write_json(tmp_path, snap)
+
+        with self._lock, self.file_lock:
+            current = self.snapshot()
+            data_stat, journal_stat = self._current[1]
+            if data_stat != loaded[0] or (loaded[1] is not None and
+                                          (journal_stat is None or journal_stat[0] != loaded[1][0])):
+                # Another process compacted or rewrote the files meanwhile, so
+                # offset no longer points into the journal we are reading.
+                os.remove(tmp_path)
+                return
+            tail = b''
+            if self._journal_offset > offset:
+                with open(self.journal_path, 'rb') as f:
+                    f.seek(offset)
+                    tail = f.read(self._journal_offset - offset)
+            os.replace(tmp_path, self.path)
+            _fsync_dir(os.path.dirname(self.path))
+            self._reset_journal(seq, tail)
+            self._journal_entries -= entries
+            self._current = (current, self._signature())
+            self._count('compactions')
+            data_stat = self._current[1][0]
+        # The new data file holds the compacted snapshot, so it can be cached as is
+        if self.write_cache and data_stat is not None:
+            self._write_cache(snap, data_stat)
+
+    def changes_since(self, since):
+        """Returns the current save sequence number and the (seq, name) saves after since.
+
+        The saves are None when since is too old to catch up from.
+        """
+        return self.changes.since(since)
+
+    def wait_for_change(self, since, timeout, poll=1.0):
+        """Waits up to timeout seconds for a save after since, like changes_since().
+
+        Checks the files every poll seconds for saves by other processes.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self.snapshot()
+            latest, changes = self.changes.since(since)
+            remaining = deadline - time.monotonic()
+            if changes is None or changes or remaining <= 0:
+                return latest, changes
+            self.changes.wait(since, min(poll, remaining))
+
+    def add_listener(self, callback):
+        """Calls callback() from the saving thread whenever saves are seen."""
+        self.changes.add_listener(callback)
+
+    def start_watcher(self, interval=1.0):
+        """Checks the files every interval seconds in a background thread.
+
+        Saves made by other processes are then loaded as they happen instead
+        of by the next request that reads the data.
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return self._watcher
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.snapshot()
+                except Exception:
+                    # Try again on the next check
+                    pass
+        self._watcher = threading.Thread(target=watch, name='statblock-watcher', daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def export(self, path):
+        """Writes the current data set to path in the data file format."""
+        write_json_atomic(path, self.snapshot())
+
+    def info(self):
+        """Returns the cache counters and the current data version."""
+        with self._stats_lock:
+            info = dict(self.stats)
+        info['version'] = self._version
+        info['seq'] = self._seq
+        info['journal_entries'] = self._journal_entries
+        snap = self._current[0]
+        info['records'] = len(snap) if snap is not None else 0
+        return info
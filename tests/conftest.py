@@ -0,0 +1,20 @@
+import os
+import sys
+import shutil
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import app as codex
+from store import StatblockStore
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A test client for the app, saving to a copy of the default statblocks."""
+    default = tmp_path / 'statblocks_default.json'
+    shutil.copy(codex.DEFAULT_FILE, default)
+    monkeypatch.setattr(codex, 'store', StatblockStore(str(tmp_path / 'statblocks.json'), str(default)))
+    return codex.app.test_client()
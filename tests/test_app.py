@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.mark.parametrize('timeout', ['nan', 'NaN', 'inf', '-inf', 'soon'])
+def test_changes_rejects_timeouts_that_are_not_finite_numbers(client, timeout):
+    response = client.get(f'/api/changes?format=json&timeout={timeout}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'timeout must be a number'}
+
+
+def test_changes_returns_at_once_with_a_zero_timeout(client):
+    response = client.get('/api/changes?format=json&timeout=0')
+    assert response.status_code == 200
+    assert 'version' in response.get_json()
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from search import build_haystack, edit_distance
+from store import Snapshot
+
+from conftest import ROOT_DIR
+
+
+@pytest.fixture(scope='module')
+def snap():
+    with open(f'{ROOT_DIR}/data/statblocks_default.json', encoding='utf-8') as f:
+        return Snapshot.from_records(json.load(f), 1)
+
+
+def scanned_names(stats, text):
+    return sorted(s['name'] for s in stats if text in build_haystack(s))
+
+
+def found_names(snap, text):
+    return sorted(s['name'] for s in snap.search('', None, '', text)[0])
+
+
+def ranked_names(snap, text):
+    return [s['name'] for s, score in snap.rank(text, limit=5)[0]]
+
+
+@pytest.mark.parametrize('a, b, distance', [
+    ('dragon', 'dragon', 0),
+    ('dargon', 'dragon', 1),
+    ('knigt', 'knight', 1),
+    ('gorgn', 'gorgon', 1),
+    ('treant', 'traent', 1),
+    ('soldr', 'soldier', 2),
+    ('flikerfly', 'flickerfly', 1),
+    ('acid', 'acidic', 2),
+])
+def test_edit_distance(a, b, distance):
+    assert edit_distance(a, b, 2) == distance
+
+
+def test_edit_distance_stops_past_the_limit():
+    assert edit_distance('bandit', 'dragon', 1) == 2
+    assert edit_distance('bear', 'behemoth', 2) == 3
+
+
+@pytest.mark.parametrize('text, name', [
+    ('dargon', 'Young Ice Dragon'),
+    ('knigt', 'Knight Of The Realm'),
+    ('gorgn', 'Gorgon'),
+    ('bandt', 'Jagged Knife Bandit'),
+    ('traent', 'Oak Treant'),
+    ('sylvn soldr', 'Sylvan Soldier'),
+])
+def test_ranked_search_finds_misspelled_words(snap, text, name):
+    assert name in ranked_names(snap, text)
+
+
+def test_ranked_search_puts_the_misspelled_name_first(snap):
+    assert ranked_names(snap, 'minor trent')[0] == 'Minor Treant'
+    assert all('Dragon' in name for name in ranked_names(snap, 'dragn')[:4])
+
+
+def test_ranked_search_finds_swapped_middle_letters(snap):
+    # "baer" and "bear" have no trigram in common
+    assert 'Bear' in ranked_names(snap, 'baer')
+
+
+def test_ranked_search_ignores_words_too_many_typos_away(snap):
+    # Four to seven letters allow one typo
+    assert ranked_names(snap, 'bxxr') == []
+    assert ranked_names(snap, 'gorgxx') == []
+
+
+@pytest.mark.parametrize('text', [
+    'flicker', 'licker', 'lickerfly', 'erfly', 'mark a stress', 'ark a stre', 'k a s', 'd8+3',
+    '8+3', 'zzq', 'e', 'ar', 'x e', 'e stress', 'ss a', ' bear', 'bear ', 'y ', ' a',
+])
+def test_substring_search_finds_what_a_scan_finds(snap, text):
+    assert found_names(snap, text) == scanned_names(list(snap), text)
+
+
+def test_substring_search_finds_words_added_by_saves(snap):
+    saved = snap.with_upsert('Zephyr Quokka', {'name': 'Zephyr Quokka', 'description': 'Quokkaesque'}, 2)
+    for text in ('zephyr quokka', 'phyr quo', 'uokka', 'okkaes', 'quokkaesq'):
+        assert found_names(saved, text) == ['Zephyr Quokka']
+        assert found_names(snap, text) == []
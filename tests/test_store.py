@@ -0,0 +1,41 @@
+import json
+import time
+import threading
+
+import search
+from store import Snapshot
+
+from conftest import ROOT_DIR
+
+
+def load_default():
+    with open(f'{ROOT_DIR}/data/statblocks_default.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_concurrent_first_searches_build_the_index_once(monkeypatch):
+    snap = Snapshot.from_records(load_default(), 1)
+    builds = []
+    started = threading.Barrier(6)
+    build = search.SearchIndex.build
+
+    def counted(stats):
+        builds.append(1)
+        # Long enough for the other searches to arrive meanwhile
+        time.sleep(0.1)
+        return build(stats)
+
+    monkeypatch.setattr(search.SearchIndex, 'build', staticmethod(counted))
+    results = []
+
+    def first_search():
+        started.wait()
+        results.append(snap.search('', None, '', 'bear')[2])
+
+    threads = [threading.Thread(target=first_search) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert len(set(results)) == 1 and results[0] > 0
@@ -0,0 +1,78 @@
+"""Production entry point for the codex.
+
+Serves the app with gunicorn (several worker processes, each with a pool
+of threads) or, where gunicorn is not available, with waitress (threads in
+a single process):
+
+    python wsgi.py --workers 4 --threads 8
+
+Other WSGI servers can load the app from here too, for example
+gunicorn --preload wsgi:app. The data is loaded when this module is
+imported, so with preloading it is read once before the workers fork.
+"""
+import os
+import sys
+import argparse
+
+from app import app, store, preload_data, WATCH_INTERVAL
+
+
+def run_gunicorn(host, port, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class CodexApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True)
+            # Threads do not survive the fork, so each worker starts its own watcher
+            self.cfg.set('post_fork', lambda server, worker: store.start_watcher(WATCH_INTERVAL))
+
+        def load(self):
+            return app
+
+    CodexApplication().run()
+
+
+def run_waitress(host, port, threads):
+    import waitress
+
+    store.start_watcher(WATCH_INTERVAL)
+    waitress.serve(app, host=host, port=port, threads=threads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the codex with a production WSGI server.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8282)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('CODEX_WORKERS', '1')),
+                        help='Worker processes (gunicorn only)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('CODEX_THREADS', '8')),
+                        help='Threads per worker process')
+    args = parser.parse_args(argv)
+
+    try:
+        import gunicorn  # noqa: F401
+        server = 'gunicorn'
+    except ImportError:
+        try:
+            import waitress  # noqa: F401
+            server = 'waitress'
+        except ImportError:
+            parser.error('Install gunicorn or waitress to serve the codex in production')
+
+    if server == 'gunicorn':
+        run_gunicorn(args.host, args.port, args.workers, args.threads)
+    else:
+        if args.workers > 1:
+            parser.error('waitress serves from a single process; install gunicorn to use --workers')
+        run_waitress(args.host, args.port, args.threads)
+    return 0
+
+
+preload_data()
+
+if __name__ == '__main__':
+    sys.exit(main())